@@ -0,0 +1,115 @@
+# Copyright (C) 2025 nouveaubot contributors
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from aiogram.types import Message
+from aiogram.filters import Filter
+from aiogram import Dispatcher, Bot
+
+from typing import Any, Awaitable, Callable, Iterable
+import re
+
+_CommandHandler = Callable[[Message], Awaitable[Any]]
+
+
+# Один фильтр на весь диспетчер: команда разбирается один раз на сообщение
+# и ищется в словаре, а не прогоняется через регулярку каждого хендлера
+class CommandRouter(Filter):
+    _exact: dict[str, _CommandHandler]
+    _suffixed: dict[str, tuple[_CommandHandler, re.Pattern]]
+    username: str | None  # выставляется при старте из единственного getMe
+
+    def __init__(self) -> None:
+        self._exact = {}
+        self._suffixed = {}
+        self.username = None
+
+    @staticmethod
+    def of(dp: Dispatcher) -> "CommandRouter":
+        router = dp.get("command_router")
+        if router is None:
+            router = CommandRouter()
+            dp["command_router"] = router
+            dp.message(router)(router._dispatch)
+        return router
+
+    @staticmethod
+    def setup(
+        aliases: list[str],
+        dp: Dispatcher,
+        handler: _CommandHandler,
+        *,
+        allow_suffix_for: Iterable[str] | None = None,     # alias_suffix, например /omon_ukrf
+        suffix_pattern: str = r"[a-z]+"                    # по умолчанию: только a-z
+    ) -> None:
+        CommandRouter.of(dp).add(aliases, handler, allow_suffix_for=allow_suffix_for, suffix_pattern=suffix_pattern)
+
+    def add(
+        self,
+        aliases: Iterable[str],
+        handler: _CommandHandler,
+        *,
+        allow_suffix_for: Iterable[str] | None = None,
+        suffix_pattern: str = r"[a-z]+"
+    ) -> None:
+        allow = set(allow_suffix_for or [])
+        suffix_re = re.compile(suffix_pattern)
+        for alias in aliases:
+            if alias in self._exact:
+                raise ValueError(f"command /{alias} is already registered")
+            self._exact[alias] = handler
+            if alias in allow:
+                self._suffixed[alias] = (handler, suffix_re)
+
+    def resolve(self, text: str, username: str | None) -> _CommandHandler | None:
+        # /cmd, /cmd@username или /alias_suffix; за командой — пробел или конец текста
+        if len(text) < 2 or text[0] != "/" or text[1].isspace():
+            return None
+        head = text[1:].split(None, 1)[0]
+        cmd, at, mention = head.partition("@")
+        if not cmd or (at and mention != username):
+            return None
+
+        handler = self._exact.get(cmd)
+        if handler is not None:
+            return handler
+        # база alias может сама содержать "_", поэтому пробуем каждое подчёркивание
+        i = cmd.find("_")
+        while i != -1:
+            entry = self._suffixed.get(cmd[:i])
+            if entry is not None and entry[1].fullmatch(cmd[i + 1:]):
+                return entry[0]
+            i = cmd.find("_", i + 1)
+        return None
+
+    async def __call__(self, message: Message, bot: Bot) -> bool | dict[str, Any]:
+        text = message.text or message.caption
+        # обычная болтовня отсеивается здесь, без разбора
+        if not text or text[0] != "/":
+            return False
+
+        if self.username is None:
+            me = await bot.me()
+            if me.username is None:
+                raise RuntimeError("Cannnot fetch bot's username")
+            self.username = me.username
+
+        handler = self.resolve(text, self.username)
+        if handler is None:
+            return False
+        return {"command_handler": handler}
+
+    @staticmethod
+    async def _dispatch(message: Message, command_handler: _CommandHandler) -> None:
+        await command_handler(message)
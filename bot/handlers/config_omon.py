@@ -13,13 +13,17 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import csv
+import io
+import json
 import os
 from aiogram import Dispatcher, Bot
-from aiogram.types import Message
+from aiogram.types import BufferedInputFile, Message
 from aiogram.enums.parse_mode import ParseMode
 
-from bot.command_filter import CommandFilter
+from bot.command_router import CommandRouter
 from bot.handler import Handler
+from bot.utils.render_cache import RenderCache
 
 from bot.utils.omon_db import (
     CodeRecord, OmonDB
@@ -30,9 +34,17 @@ class ConfigOmonHandler(Handler):
     _DEL_USAGE = 'удалить кодекс: <b>/config_omon del <i>[имя кодекса]</i></b>'
     _ADDS_USAGE = 'добавить статью: <b>/config_omon adds <i>[имя кодекса] [название статьи] [описание статьи...]</i></b>'
     _DELS_USAGE = 'удалить статью: <b>/config_omon dels <i>[имя кодекса] [название статьи]</i></b>'
+    _IMPORT_USAGE = ('загрузить статьи из файла: <b>/config_omon import <i>[имя кодекса]</i></b> '
+                     'в подписи к документу (csv, json или txt: «название описание» в строке)')
+    _EXPORT_USAGE = 'выгрузить статьи в файл: <b>/config_omon export <i>[имя кодекса]</i></b>'
+
+    # столько же, сколько разрешает триггер на кодекс
+    _IMPORT_MAX_SENTENCES = 500
+    _IMPORT_MAX_BYTES = 1024 * 1024
 
     _db: OmonDB
     _bot: Bot
+    _renders: RenderCache
 
     @property
     def aliases(self) -> list[str]:
@@ -44,8 +56,9 @@ class ConfigOmonHandler(Handler):
 
     def __init__(self, dp: Dispatcher, bot: Bot, static_path: str, db_file: str) -> None:
         self._bot = bot
-        self._db = OmonDB.instance(db_file, os.path.join(static_path, 'omon.sql'))
-        CommandFilter.setup(self.aliases, dp, bot, self._handle)
+        self._db = OmonDB.instance(db_file, os.path.join(static_path, 'omon'))
+        self._renders = RenderCache.instance()
+        CommandRouter.setup(self.aliases, dp, self._handle)
 
     @staticmethod
     def _chat_id_from_message(m: Message) -> int | None:
@@ -58,7 +71,9 @@ class ConfigOmonHandler(Handler):
             return
         
         codes = await self._db.get_codes(chat_id)
-        args = message.text.split()[1:] if message.text else []
+        # import приходит подписью к документу
+        text = message.text or message.caption
+        args = text.split()[1:] if text else []
 
         usage = f"""кодексы в чате:
 {("\n".join(f"• {code.name} ({code.n_sentences})" for code in codes) if codes else "— нет —")}
@@ -69,7 +84,11 @@ class ConfigOmonHandler(Handler):
 
 {self._DEL_USAGE}
 
-{self._DELS_USAGE}"""
+{self._DELS_USAGE}
+
+{self._IMPORT_USAGE}
+
+{self._EXPORT_USAGE}"""
 
         if not args:
             await message.answer(usage, parse_mode=ParseMode.HTML)
@@ -84,6 +103,10 @@ class ConfigOmonHandler(Handler):
                 await self._on_adds(message, args, codes)
             case 'dels':
                 await self._on_dels(message, args, codes)
+            case 'import':
+                await self._on_import(message, args, codes)
+            case 'export':
+                await self._on_export(message, args, codes)
             case _:
                 await message.answer(usage, parse_mode=ParseMode.HTML)
             
@@ -106,6 +129,7 @@ class ConfigOmonHandler(Handler):
 
         try:
             n = await self._db.delete_code(chat_id, args[1])
+            self._renders.drop_command("omon")
             await message.answer("удалено" if n else "не найдено")
         except Exception as e:
             await message.answer(f"ошибка: {e}")
@@ -122,6 +146,8 @@ class ConfigOmonHandler(Handler):
             return
         try:
             await self._db.upsert_sentence(cid, sentence, desc)
+            # готовые картинки /omon содержат тексты статей — сбрасываем их
+            self._renders.drop_command("omon")
             await message.answer("ок")
         except Exception as e:
             await message.answer(f"ошибка: {e}")
@@ -138,6 +164,81 @@ class ConfigOmonHandler(Handler):
             return
         try:
             n = await self._db.delete_sentence(cid, sentence)
+            self._renders.drop_command("omon")
             await message.answer("удалено" if n else "не найдено")
         except Exception as e:
             await message.answer(f"ошибка: {e}")
+
+    @staticmethod
+    def _parse_sentences(file_name: str, data: bytes) -> list[tuple[str, str]]:
+        # csv: название,описание; json: {"название": "описание"} или [[название, описание], ...];
+        # иначе — текст, как в adds: первое слово строки название, остальное описание
+        text = data.decode("utf-8-sig")
+        ext = os.path.splitext(file_name.lower())[1]
+        if ext == ".json":
+            raw = json.loads(text)
+            pairs = raw.items() if isinstance(raw, dict) else raw
+        elif ext == ".csv":
+            pairs = (row for row in csv.reader(io.StringIO(text)) if row)
+        else:
+            pairs = (line.split(None, 1) for line in text.splitlines() if line.strip())
+
+        sentences: dict[str, str] = {}
+        for pair in pairs:
+            if not isinstance(pair, (list, tuple)) or len(pair) != 2:
+                raise ValueError(f"ожидалась пара название/описание: {str(pair)[:50]}")
+            name, desc = str(pair[0]).strip(), str(pair[1]).strip()
+            if not name or not desc or len(name.split()) != 1:
+                raise ValueError(f"плохая статья: {name[:50]}")
+            sentences[name] = desc
+        return list(sentences.items())
+
+    async def _on_import(self, message: Message, args: list[str], codes: list[CodeRecord]):
+        document = message.document
+        if len(args) != 2 or document is None:
+            await message.answer(self._IMPORT_USAGE, parse_mode=ParseMode.HTML)
+            return
+
+        cid = next((x.id for x in codes if x.name == args[1].strip()), None)
+        if cid is None:
+            await message.answer("кодекс не найден")
+            return
+        if document.file_size is not None and document.file_size > self._IMPORT_MAX_BYTES:
+            await message.answer("файл слишком большой")
+            return
+        try:
+            data = await self._bot.download(document)
+            if data is None:
+                await message.answer("не удалось скачать файл")
+                return
+            sentences = self._parse_sentences(document.file_name or "", data.read())
+            if not sentences:
+                await message.answer("в файле нет статей")
+                return
+            if len(sentences) > self._IMPORT_MAX_SENTENCES:
+                await message.answer(f"не больше {self._IMPORT_MAX_SENTENCES} статей за раз")
+                return
+            await self._db.upsert_sentences(cid, sentences)
+            self._renders.drop_command("omon")
+            await message.answer(f"загружено статей: {len(sentences)}")
+        except Exception as e:
+            await message.answer(f"ошибка: {e}")
+
+    async def _on_export(self, message: Message, args: list[str], codes: list[CodeRecord]):
+        if len(args) != 2:
+            await message.answer(self._EXPORT_USAGE, parse_mode=ParseMode.HTML)
+            return
+
+        code = args[1].strip()
+        cid = next((x.id for x in codes if x.name == code), None)
+        if cid is None:
+            await message.answer("кодекс не найден")
+            return
+        sentences = await self._db.load_sentences(cid)
+        if not sentences:
+            await message.answer("в кодексе нет статей")
+            return
+        # тот же csv принимает import
+        out = io.StringIO()
+        csv.writer(out).writerows(sorted(sentences.items()))
+        await message.answer_document(BufferedInputFile(out.getvalue().encode("utf-8"), filename=f"{code}.csv"))
@@ -16,7 +16,7 @@
 from aiogram import Dispatcher, Bot
 from aiogram.types import Message
 
-from bot.command_filter import CommandFilter
+from bot.command_router import CommandRouter
 from bot.utils.message_data_fetchers import fetch_text_from_message
 from bot.handler import Handler
 
@@ -36,7 +36,7 @@ class CPHandler(Handler):
         return "тупой юмор"
 
     def __init__(self, dp: Dispatcher, bot: Bot) -> None:
-        CommandFilter.setup(self.aliases, dp, bot, self._handle)
+        CommandRouter.setup(self.aliases, dp, self._handle)
 
     async def _handle(self, message: Message) -> None:
         txt = fetch_text_from_message(message)
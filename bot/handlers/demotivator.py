@@ -15,11 +15,7 @@
 
 import logging
 from math import floor, ceil
-import asyncio
-import io
 
-import cv2
-import numpy as np
 import cairo
 import gi
 
@@ -30,19 +26,29 @@ from gi.repository import Pango, PangoCairo
 from aiogram import Dispatcher, Bot
 from aiogram.types import Message, BufferedInputFile
 
-from bot.command_filter import CommandFilter
+from bot.command_router import CommandRouter
 from bot.utils.message_data_fetchers import fetch_image_from_message
-from bot.utils.pool_executor import executor
+from bot.utils.image_decode import ImageTooLargeError, decode_image
+from bot.utils.image_encode import encode_surface
+from bot.utils.shm_transport import ShmHandle, SharedImage, attached
+from bot.utils.download import download_to_shm, release
+from bot.utils.deadline import Deadline, DeadlineExceeded, check_deadline, deadline_for, deadline_seconds
+from bot.utils.render_scheduler import RenderBusyError, RenderScheduler
+from bot.utils.render_cache import RenderCache
 from bot.handler import Handler
-from bot.utils.cairo_helpers import scale_dims, scale_for_tg, image_surface_from_cv2_img, layout_text
+from bot.utils.cairo_helpers import upscale_factor, tg_canvas, paint_scaled, image_surface_from_cv2_img, layout_text
 
 
 class DemotivatorHandler(Handler):
     _BIG_FONT_SIZE = 0.052
     _SM_FONT_SIZE = 0.036
     _MIN_IMG_W = 512
+    _TARGET_SIZE = 1024
+    _DEADLINE = deadline_seconds("dem")
 
     _bot: Bot
+    _renders: RenderCache
+    _scheduler: RenderScheduler
 
     @property
     def aliases(self) -> list[str]:
@@ -54,22 +60,31 @@ class DemotivatorHandler(Handler):
 
     def __init__(self, dp: Dispatcher, bot: Bot) -> None:
         self._bot = bot
-        CommandFilter.setup(self.aliases, dp, bot, self._handle)
+        self._renders = RenderCache.instance()
+        self._scheduler = RenderScheduler.instance()
+        CommandRouter.setup(self.aliases, dp, self._handle)
 
     @staticmethod
-    def create(img_data: bytes, text1: str, _text2: list[str]) -> bytes | str:
+    def create(img: ShmHandle, text1: str, _text2: list[str], deadline: Deadline = None) -> SharedImage | str:
         text2 = '\n'.join(_text2)
 
         # decode via OpenCV
-        nparr = np.frombuffer(img_data, np.uint8)
-        cv2img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if cv2img is None:
+        try:
+            with attached(img) as img_data:
+                decoded = decode_image(img_data, DemotivatorHandler._TARGET_SIZE)
+        except ImageTooLargeError:
+            return "пикча слишком большая"
+        if decoded is None:
             return "не удалось обработать изображение"
+        cv2img, _ = decoded
+        check_deadline(deadline)
 
-        # convert to cairo surface
+        # convert to cairo surface; размеры ниже — в единицах раскладки (растянутая картинка),
+        # в пиксели холста их переводит контекст из tg_canvas
         src_surf = image_surface_from_cv2_img(cv2img)
-        img_surf, _ = scale_dims(src_surf)
-        img_w, img_h = img_surf.get_width(), img_surf.get_height()
+        img_scale = upscale_factor(src_surf.get_width(), src_surf.get_height())
+        img_w = max(1, int(src_surf.get_width() * img_scale))
+        img_h = max(1, int(src_surf.get_height() * img_scale))
 
         # output width = floor(img.width * 1.1)
         out_w = floor(img_w * 1.1)
@@ -79,28 +94,26 @@ class DemotivatorHandler(Handler):
         stroke_width = max(1, ceil(img_w / 500))
         k = stroke_width * 4  # expansion around image for frame polygon
 
-        # prepare text layouts to get heights
+        # prepare text layouts to get heights (layout pre-pass: до создания холста)
         # big line
-        tmp1 = cairo.ImageSurface(cairo.FORMAT_ARGB32, out_w, 1)
-        cr1 = cairo.Context(tmp1)
+        tmp = cairo.ImageSurface(cairo.FORMAT_ARGB32, 1, 1)
+        tmp_cr = cairo.Context(tmp)
         big_font_px = DemotivatorHandler._BIG_FONT_SIZE * out_w
-        layout1, big_w, big_h = layout_text(cr1, text1, "serif", big_font_px, width=out_w, alignment=Pango.Alignment.CENTER)
+        layout1, big_w, big_h = layout_text(tmp_cr, text1, "serif", big_font_px, width=out_w, alignment=Pango.Alignment.CENTER)
         
         # small block
         sm_h = 0
         layout2: Pango.Layout | None = None
         if text2:
-            tmp2 = cairo.ImageSurface(cairo.FORMAT_ARGB32, out_w, 1)
-            cr2 = cairo.Context(tmp2)
             sm_font_px = DemotivatorHandler._SM_FONT_SIZE * out_w
-            layout2, sm_w, sm_h = layout_text(cr2, text2, "sans", sm_font_px, width=out_w, alignment=Pango.Alignment.CENTER)
+            layout2, sm_w, sm_h = layout_text(tmp_cr, text2, "sans", sm_font_px, width=out_w, alignment=Pango.Alignment.CENTER)
 
         # compute total height:
         # dem1.height + dem2.height + img.height + floor(0.12 * img.width)
         spacer = floor(0.12 * img_w)
         out_h = (big_h + sm_h + img_h + spacer)
-        out = cairo.ImageSurface(cairo.FORMAT_ARGB32, out_w, out_h)
-        cr = cairo.Context(out)
+        # холст сразу в итоговом для Telegram размере
+        out, cr = tg_canvas(out_w, out_h)
 
         # black background
         cr.set_source_rgb(0, 0, 0)
@@ -115,10 +128,7 @@ class DemotivatorHandler(Handler):
         cr.restore()
 
         # draw image
-        cr.save()
-        cr.set_source_surface(img_surf, img_left, img_top)
-        cr.paint()
-        cr.restore()
+        paint_scaled(cr, src_surf, img_left, img_top, img_scale)
 
         # y start for dem1 (original: floor(0.07 * img.width + img.height))
         img_height_top = floor(0.07 * img_w + img_h)
@@ -140,12 +150,8 @@ class DemotivatorHandler(Handler):
             PangoCairo.show_layout(cr, layout2)
         cr.restore()
 
-        # final scale/letterbox for Telegram by helper
-        final_surf = scale_for_tg(out)
-
-        buf = io.BytesIO()
-        final_surf.write_to_png(buf)
-        return buf.getvalue()
+        check_deadline(deadline)
+        return SharedImage.from_encoded(encode_surface(out))
     
     @staticmethod
     def _extract_lines(message: Message) -> list[str]:
@@ -177,25 +183,45 @@ class DemotivatorHandler(Handler):
 
     async def _handle(self, message: Message) -> None:
         lines = self._extract_lines(message)
-        photo = fetch_image_from_message(message)
+        photo = fetch_image_from_message(message, DemotivatorHandler._TARGET_SIZE)
 
         if not photo:
             await message.answer("нужно прикрепить пикчу")
             return
 
-        stream = await self._bot.download(photo)
-        if not stream:
-            await message.answer("не удалось скачать пикчу")
+        render_key = ("dem", photo.file_unique_id, tuple(lines))
+        if await self._renders.answer_cached(message, render_key, "ваша пикча"):
             return
 
-        pic = await asyncio.get_running_loop().run_in_executor(None, stream.read)
-        result = await asyncio.get_running_loop().run_in_executor(executor, DemotivatorHandler.create, pic, lines[0], lines[1:])
+        try:
+            job = self._scheduler.reserve(message.chat.id, deadline_for(message, self._DEADLINE))
+        except RenderBusyError as e:
+            await message.answer(str(e))
+            return
+        except DeadlineExceeded:
+            logging.info(f"dropped stale /dem in chat {message.chat.id}")
+            return
 
-        if isinstance(result, bytes):
-            await message.answer_photo(
-                BufferedInputFile(result, "image.png"),
+        with job:
+            pic_handle = await download_to_shm(self._bot, photo)
+            if pic_handle is None:
+                await message.answer("не удалось скачать пикчу")
+                return
+            try:
+                result = await job.run(DemotivatorHandler.create, pic_handle, lines[0], lines[1:], job.deadline)
+            except DeadlineExceeded:
+                logging.info(f"dropped stale /dem in chat {message.chat.id}")
+                return
+            finally:
+                job.when_idle(release, pic_handle)
+
+        if isinstance(result, SharedImage):
+            encoded = result.take()
+            sent = await message.answer_photo(
+                BufferedInputFile(encoded.data, encoded.filename),
                 caption="ваша пикча",
             )
+            self._renders.remember_sent(render_key, sent)
         elif isinstance(result, str):
             await message.answer(result)
         else:
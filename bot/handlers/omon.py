@@ -13,17 +13,14 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import io
 import os
-import random
-import asyncio
+import cv2
 import logging
+import random
 import re
 from typing import Callable
 
-import cv2
 from natsort import natsorted
-import numpy as np
 import cairo
 import gi
 
@@ -34,12 +31,20 @@ from aiogram import Dispatcher, Bot
 from aiogram.types import Message, BufferedInputFile
 from aiogram.enums.parse_mode import ParseMode
 
-from bot.command_filter import CommandFilter
+from bot.command_router import CommandRouter
 from bot.utils.message_data_fetchers import fetch_image_from_message
-from bot.utils.detect_faces import detect_faces
-from bot.utils.pool_executor import executor
+from bot.utils.image_decode import ImageTooLargeError, decode_image
+from bot.utils.image_encode import encode_surface
+from bot.utils.shm_transport import ShmHandle, SharedImage, attached
+from bot.utils.download import download_to_shm, release
+from bot.utils.face_service import FaceServiceUnavailable, detect_faces
+from bot.utils.face_cache import FaceCache
+from bot.utils.detect_faces import Box
+from bot.utils.deadline import Deadline, DeadlineExceeded, check_deadline, deadline_for, deadline_seconds
+from bot.utils.render_scheduler import RenderBusyError, RenderScheduler
+from bot.utils.render_cache import RenderCache
 from bot.utils.misc import scale_norm
-from bot.utils.cairo_helpers import scale_dims, scale_for_tg, layout_text, image_surface_from_cv2_img
+from bot.utils.cairo_helpers import upscale_factor, tg_canvas, paint_scaled, layout_text, image_surface_from_cv2_img
 from bot.handler import Handler
 from bot.utils.omon_db import (
     CodeRecord, OmonDB
@@ -51,9 +56,15 @@ class OmonHandler(Handler):
     _FRAME_TEXT_FONT_SIZE_K = 10.5 / 512
     _BOTTOM_TEXT_FONT_K = 10.5 / 512
     _FONT_FAMILY = 'DejaVu Sans Mono'
+    _TARGET_SIZE = 1280
+    _DEADLINE = deadline_seconds("omon")
+    _MAX_CANDIDATES = 32  # случайных статей в воркер, пока число лиц неизвестно
 
     _bot: Bot
     _db: OmonDB
+    _faces: FaceCache
+    _renders: RenderCache
+    _scheduler: RenderScheduler
 
     @property
     def aliases(self) -> list[str]:
@@ -63,10 +74,13 @@ class OmonHandler(Handler):
     def description(self) -> str:
         return 'статьи УК РФ для каждого на картинке'
 
-    def __init__(self, dp: Dispatcher, bot: Bot, static_path: str, db_file: str) -> None:
+    def __init__(self, dp: Dispatcher, bot: Bot, static_path: str, db_file: str, faces_db_file: str) -> None:
         self._bot = bot
-        self._db = OmonDB.instance(db_file, os.path.join(static_path, 'omon.sql'))
-        CommandFilter.setup(self.aliases, dp, bot, self._handle, allow_suffix_for=self.aliases)
+        self._db = OmonDB.instance(db_file, os.path.join(static_path, 'omon'))
+        self._faces = FaceCache.instance(faces_db_file)
+        self._renders = RenderCache.instance()
+        self._scheduler = RenderScheduler.instance()
+        CommandRouter.setup(self.aliases, dp, self._handle, allow_suffix_for=self.aliases)
 
     @staticmethod
     def _list_codes_text(codes: list[CodeRecord]) -> str:
@@ -80,43 +94,89 @@ class OmonHandler(Handler):
         return int(round(x / 2) * 2)
 
     @staticmethod
-    def process_image(img_data: bytes, sentences: dict[str, str], manual_sentences: list[str]) -> str | bytes:
-        nparr = np.frombuffer(img_data, np.uint8)
-        cv2img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if cv2img is None:
+    def _decode(img: ShmHandle) -> tuple[cv2.typing.MatLike, float] | str:
+        try:
+            with attached(img) as img_data:
+                decoded = decode_image(img_data, OmonHandler._TARGET_SIZE)
+        except ImageTooLargeError:
+            return 'пикча слишком большая'
+        if decoded is None:
             return 'не удалось обработать изображение'
-        faces = detect_faces(cv2img)
-        if len(faces) == 0:
-            return "лица не обнаружены"
-        
-        chosen_sentences: list[tuple[str, str]] = []
-
-        # ручные статьи
-        for i, sentence in enumerate(manual_sentences):
-            if i >= len(faces):
-                break
-            if sentence not in sentences:
-                return f'статья {sentence} не найдена'
-            chosen_sentences.append((sentence, sentences[sentence]))
-
-        # добор до количества лиц
-        remaining = len(faces) - len(chosen_sentences)
-        if remaining > 0:
-            exclude = {name for name, _ in chosen_sentences}
-            pool = [(k, v) for k, v in sentences.items() if k not in exclude]
-            if not pool:
+        return decoded
+
+    @staticmethod
+    def _choose_sentences(n: int, manual: list[str], known: dict[str, str],
+                          candidates: list[tuple[str, str]]) -> list[tuple[str, str]] | str:
+        # ровно по статье на лицо: сначала ручные, остальное — из случайных кандидатов
+        manual = manual[:n]
+        missing = next((x for x in manual if x not in known), None)
+        if missing is not None:
+            return f'статья {missing} не найдена'
+        chosen = [(x, known[x]) for x in manual]
+        rest = n - len(chosen)
+        if rest > 0:
+            if not candidates:
                 return 'нет статей для выбора'
-            if len(pool) >= remaining:
-                chosen_sentences += random.sample(pool, remaining)
-            else:
-                chosen_sentences += pool
-                extra = remaining - len(pool)
-                chosen_sentences += random.choices(pool, k=extra)
+            chosen += candidates[:rest] + random.choices(candidates, k=max(0, rest - len(candidates)))
+        return chosen
+
+    @staticmethod
+    def process_image(img: ShmHandle, faces: list[Box] | None, manual: list[str], known: dict[str, str],
+                      candidates: list[tuple[str, str]],
+                      deadline: Deadline = None) -> tuple[SharedImage | str, list[Box] | None]:
+        # детекция (если лиц нет в кэше) и рендер за один заход в воркер и одно декодирование.
+        # Вторым элементом — найденные лица в координатах оригинала (так их хранит кэш)
+        decoded = OmonHandler._decode(img)
+        if isinstance(decoded, str):
+            return decoded, None
+        cv2img, decode_scale = decoded
+        check_deadline(deadline)
+
+        found = None
+        if faces is None:
+            try:
+                found = faces = [f.scaled(1 / decode_scale) for f in detect_faces(cv2img)]
+            except FaceServiceUnavailable:
+                return "поиск лиц сейчас недоступен, попробуйте позже", None
+            check_deadline(deadline)
+        if len(faces) == 0:
+            return "лица не обнаружены", found
 
+        chosen_sentences = OmonHandler._choose_sentences(len(faces), manual, known, candidates)
+        if isinstance(chosen_sentences, str):
+            return chosen_sentences, found
+        faces = [f.scaled(decode_scale) for f in faces]
+        return OmonHandler._render(cv2img, faces, chosen_sentences, deadline), found
+
+    @staticmethod
+    def _render(cv2img: cv2.typing.MatLike, faces: list[Box], chosen_sentences: list[tuple[str, str]],
+                deadline: Deadline = None) -> SharedImage:
+        # лица — в координатах декодированной картинки, статей ровно по одной на лицо, в том же порядке
+        # размеры ниже — в единицах раскладки (растянутая картинка),
+        # в пиксели холста их переводит контекст из tg_canvas
         src_surf = image_surface_from_cv2_img(cv2img)
-        work_surf, scale = scale_dims(src_surf)
-        scaled_w, scaled_h = work_surf.get_width(), work_surf.get_height()
-        work_cr = cairo.Context(work_surf)
+        scale = upscale_factor(src_surf.get_width(), src_surf.get_height())
+        scaled_w = max(1, int(src_surf.get_width() * scale))
+        scaled_h = max(1, int(src_surf.get_height() * scale))
+
+        # Нижний блок с перечислением статей, сразу нужной ширины; его высота
+        # нужна заранее, чтобы создать холст итогового размера
+        bottom_txt = "\n".join("Статья {}. {}".format(x, y) for (x, y) in natsorted(chosen_sentences, lambda s: s[0]))
+        bottom_font_size = OmonHandler._BOTTOM_TEXT_FONT_K * scaled_w
+
+        appendix_w = scaled_w
+        tmp_surf2 = cairo.ImageSurface(cairo.FORMAT_ARGB32, 1, 1)
+        tmp_cr2 = cairo.Context(tmp_surf2)
+        layout_bottom, _, bottom_h = layout_text(tmp_cr2, bottom_txt, OmonHandler._FONT_FAMILY, bottom_font_size, width=appendix_w)
+        appendix_h = max(1, bottom_h)
+
+        final_surf, work_cr = tg_canvas(scaled_w, scaled_h + appendix_h)
+
+        # картинка с рамками; подписи обрезаются по её границам, как и раньше
+        work_cr.save()
+        work_cr.rectangle(0, 0, scaled_w, scaled_h)
+        work_cr.clip()
+        paint_scaled(work_cr, src_surf, 0, 0, scale)
 
         label_draws: list[Callable[[], None]] = []
 
@@ -158,44 +218,20 @@ class OmonHandler(Handler):
 
         for f in label_draws:
             f()
+        work_cr.restore()
 
-        # Нижний блок с перечислением статей, сразу нужной ширины
-        bottom_txt = "\n".join("Статья {}. {}".format(x, y) for (x, y) in natsorted(chosen_sentences, lambda s: s[0]))
-        bottom_font_size = OmonHandler._BOTTOM_TEXT_FONT_K * scaled_w
-
-        appendix_w = scaled_w
-        tmp_surf2 = cairo.ImageSurface(cairo.FORMAT_ARGB32, appendix_w, 1)
-        tmp_cr2 = cairo.Context(tmp_surf2)
-        layout_bottom, _, bottom_h = layout_text(tmp_cr2, bottom_txt, OmonHandler._FONT_FAMILY, bottom_font_size, width=appendix_w)
+        work_cr.save()
+        work_cr.set_source_rgb(0, 0, 0)
+        work_cr.rectangle(0, scaled_h, appendix_w, appendix_h)
+        work_cr.fill()
+        work_cr.translate(0, scaled_h)
+        PangoCairo.update_layout(work_cr, layout_bottom)
+        work_cr.set_source_rgb(0, 1, 0)
+        PangoCairo.show_layout(work_cr, layout_bottom)
+        work_cr.restore()
 
-        appendix_h = max(1, bottom_h)
-        appendix = cairo.ImageSurface(cairo.FORMAT_ARGB32, appendix_w, appendix_h)
-        ac = cairo.Context(appendix)
-        ac.set_source_rgb(0, 0, 0)
-        ac.rectangle(0, 0, appendix_w, appendix_h)
-        ac.fill()
-
-        ac.save()
-        ac.translate(0, 0)
-        PangoCairo.update_layout(ac, layout_bottom)
-        ac.set_source_rgb(0, 1, 0)
-        PangoCairo.show_layout(ac, layout_bottom)
-        ac.restore()
-
-        final_w = scaled_w
-        final_h = scaled_h + appendix_h
-        final_surf = cairo.ImageSurface(cairo.FORMAT_ARGB32, final_w, final_h)
-        fcr = cairo.Context(final_surf)
-        fcr.set_source_surface(work_surf, 0, 0)
-        fcr.paint()
-        fcr.set_source_surface(appendix, 0, scaled_h)
-        fcr.paint()
-
-        result = scale_for_tg(final_surf)
-
-        out = io.BytesIO()
-        result.write_to_png(out)
-        return out.getvalue()
+        check_deadline(deadline)
+        return SharedImage.from_encoded(encode_surface(final_surf))
 
     async def _handle(self, message: Message) -> None:
         text = (message.text or message.caption or "").strip()
@@ -203,31 +239,68 @@ class OmonHandler(Handler):
         code_name = (m.group(1).lower() if m and m.group(1) else None)
         manual_sentences = (m.group(2).split() if m and m.group(2) else [])
 
-        photo = fetch_image_from_message(message)
+        photo = fetch_image_from_message(message, OmonHandler._TARGET_SIZE)
         if not photo:
             codes = await self._db.get_codes(message.chat.id)
             await message.answer(self._list_codes_text(codes), parse_mode=ParseMode.HTML)
             return
 
-        stream = await self._bot.download(photo)
-        if stream is None:
-            await message.answer('не удалось скачать пикчу')
+        code_id = await self._db.get_or_default_code_id(message.chat.id, code_name)
+
+        # рендер детерминирован, только если ручных статей хватает на все лица,
+        # а это известно лишь после рендера; случайные рендеры в кэш не попадают
+        render_key = ("omon", photo.file_unique_id, code_id, tuple(manual_sentences))
+        if manual_sentences and await self._renders.answer_cached(message, render_key, "ваша пикча"):
             return
-        pic = await asyncio.get_running_loop().run_in_executor(None, stream.read)
 
-        code_id = await self._db.get_or_default_code_id(message.chat.id, code_name)
-        sentences = await self._db.load_sentences(code_id)
+        faces_key = self._faces.key(photo.file_unique_id)
+        faces = await self._faces.get(faces_key)
+        if faces is not None and len(faces) == 0:
+            await message.answer("лица не обнаружены")
+            return
 
-        result = await asyncio.get_running_loop().run_in_executor(
-            executor, self.process_image, pic, sentences, manual_sentences
-        )
+        # статьи выбираются до воркера: из кэша кодекса это обходится без запросов к базе.
+        # Пока лица неизвестны, кандидатов берём с запасом, лишние воркер не использует
+        wanted = len(faces) if faces is not None else self._MAX_CANDIDATES
+        candidates = await self._db.sample_sentences(code_id, wanted, exclude=manual_sentences)
+        known = await self._db.find_sentences(code_id, manual_sentences)
 
-        if isinstance(result, bytes):
-            buffered = BufferedInputFile(result, "image.png")
-            await message.answer_photo(buffered, caption="ваша пикча")
+        try:
+            job = self._scheduler.reserve(message.chat.id, deadline_for(message, self._DEADLINE))
+        except RenderBusyError as e:
+            await message.answer(str(e))
+            return
+        except DeadlineExceeded:
+            logging.info(f"dropped stale /omon in chat {message.chat.id}")
+            return
+
+        with job:
+            pic_handle = await download_to_shm(self._bot, photo)
+            if pic_handle is None:
+                await message.answer('не удалось скачать пикчу')
+                return
+            try:
+                result, found = await job.run(self.process_image, pic_handle, faces, manual_sentences,
+                                              known, candidates, job.deadline)
+            except DeadlineExceeded:
+                logging.info(f"dropped stale /omon in chat {message.chat.id}")
+                return
+            finally:
+                job.when_idle(release, pic_handle)
+
+        # сегмент с картинкой забираем до любого await, иначе при отмене он останется в /dev/shm
+        encoded = result.take() if isinstance(result, SharedImage) else None
+        if found is not None:
+            faces = found
+            await self._faces.put(faces_key, found)
+
+        if encoded is not None:
+            buffered = BufferedInputFile(encoded.data, encoded.filename)
+            sent = await message.answer_photo(buffered, caption="ваша пикча")
+            if faces is not None and len(manual_sentences) >= len(faces):
+                self._renders.remember_sent(render_key, sent)
         elif isinstance(result, str):
             await message.answer(result)
         else:
             logging.error(f'Unexpected process_image() result: {result}')
             await message.answer('не удалось обработать пикчу')
-
@@ -17,7 +17,7 @@ from aiogram import Dispatcher, Bot
 from aiogram.types import Message
 from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
 
-from bot.command_filter import CommandFilter
+from bot.command_router import CommandRouter
 from bot.handler import Handler
 
 
@@ -32,7 +32,7 @@ class PinHandler(Handler):
 
     def __init__(self, dp: Dispatcher, bot: Bot) -> None:
         self.bot = bot
-        CommandFilter.setup(self.aliases, dp, bot, self._handle)
+        CommandRouter.setup(self.aliases, dp, self._handle)
 
     async def _handle(self, message: Message) -> None:
         if not message.reply_to_message or message.reply_to_message.chat.id != message.chat.id:
@@ -16,7 +16,7 @@
 from aiogram import Dispatcher, Bot
 from aiogram.types import Message
 
-from bot.command_filter import CommandFilter
+from bot.command_router import CommandRouter
 from bot.handler import Handler
 
 class PingHandler(Handler):
@@ -29,7 +29,7 @@ class PingHandler(Handler):
         return 'проверить работоспособность бота'
 
     def __init__(self, dp: Dispatcher, bot: Bot) -> None:
-        CommandFilter.setup(self.aliases, dp, bot, self._handle)
+        CommandRouter.setup(self.aliases, dp, self._handle)
 
     async def _handle(self, message: Message) -> None:
         await message.answer("понг")
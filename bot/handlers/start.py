@@ -18,7 +18,7 @@ from aiogram.types import Message
 from aiogram.enums.parse_mode import ParseMode
 from aiogram.enums import ChatType
 
-from bot.command_filter import CommandFilter
+from bot.command_router import CommandRouter
 from bot.handler import Handler
 
 from typing import Iterable
@@ -37,7 +37,7 @@ class StartHandler(Handler):
 
     def __init__(self, dp: Dispatcher, bot: Bot, handlers: Iterable[Handler]) -> None:
         self._bot = bot
-        CommandFilter.setup(self.aliases, dp, bot, self._handle)
+        CommandRouter.setup(self.aliases, dp, self._handle)
         self._start_html = '\n\n'.join(f'<b>/{x.aliases[0]}{{bot_tag}}</b>: {x.description}' for x in handlers) + \
           ('\n\n<a href="https://github.com/nouveau-nvc0/nouveaubot/blob/main/LICENSE">AGPLv3</a>. '
           'All (far-)rights reserved. <a href="https://github.com/nouveau-nvc0/nouveaubot">Source code</a>')
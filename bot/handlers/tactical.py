@@ -13,22 +13,26 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import io
 from aiogram import Dispatcher, Bot
 from aiogram.types import Message, BufferedInputFile
 import cairo
-import cv2
-import numpy as np
 
-from bot.command_filter import CommandFilter
-from bot.utils.cairo_helpers import image_surface_from_cv2_img, scale_dims, scale_for_tg
+from bot.command_router import CommandRouter
+from bot.utils.cairo_helpers import image_surface_from_cv2_img, upscale_factor, tg_canvas, paint_scaled
 from bot.utils.message_data_fetchers import fetch_image_from_message
-from bot.utils.detect_faces import detect_faces
+from bot.utils.image_decode import ImageTooLargeError, decode_image
+from bot.utils.image_encode import encode_surface
+from bot.utils.shm_transport import ShmHandle, SharedImage, attached
+from bot.utils.download import download_to_shm, release
+from bot.utils.face_service import FaceServiceUnavailable, detect_faces
+from bot.utils.face_cache import FaceCache
+from bot.utils.detect_faces import Box
 from bot.utils.misc import scale_norm
-from bot.utils.pool_executor import executor
+from bot.utils.deadline import Deadline, DeadlineExceeded, check_deadline, deadline_for, deadline_seconds
+from bot.utils.render_scheduler import RenderBusyError, RenderScheduler
+from bot.utils.render_cache import RenderCache
 from bot.handler import Handler
 
-import asyncio
 import logging
 
 
@@ -37,8 +41,13 @@ class TacticalHandler(Handler):
     _BUBBLE_DOT2 = 16 / 17
     _LINE_WIDTH_K = 6 / 512
     _BUBBLE_HEIGHT_K = 0.1
+    _TARGET_SIZE = 1024
+    _DEADLINE = deadline_seconds("tactical")
 
     _bot: Bot
+    _faces: FaceCache
+    _renders: RenderCache
+    _scheduler: RenderScheduler
 
     @property
     def aliases(self) -> list[str]:
@@ -48,27 +57,51 @@ class TacticalHandler(Handler):
     def description(self) -> str:
         return 'наложить на картинку облачко говорящего'
 
-    def __init__(self, dp: Dispatcher, bot: Bot) -> None:
+    def __init__(self, dp: Dispatcher, bot: Bot, faces_db_file: str) -> None:
         self._bot = bot
-        CommandFilter.setup(self.aliases, dp, bot, self._handle)
+        self._faces = FaceCache.instance(faces_db_file)
+        self._renders = RenderCache.instance()
+        self._scheduler = RenderScheduler.instance()
+        CommandRouter.setup(self.aliases, dp, self._handle)
 
     @staticmethod
-    def process_image(img_data: bytes, face_num: int) -> bytes | str:
-        nparr = np.frombuffer(img_data, np.uint8)
-        cv2img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if cv2img is None:
-            return "не удалось обработать изображение"
+    def process_image(img: ShmHandle, face_num: int, faces: list[Box] | None = None,
+                      deadline: Deadline = None) -> tuple[SharedImage | str, list[Box] | None]:
+        # вторым элементом возвращаются лица, если они искались в этом вызове (для кэша);
+        # в кэше рамки хранятся в координатах оригинала, а не уменьшенной при декодировании копии
+        try:
+            with attached(img) as img_data:
+                decoded = decode_image(img_data, TacticalHandler._TARGET_SIZE)
+        except ImageTooLargeError:
+            return "пикча слишком большая", None
+        if decoded is None:
+            return "не удалось обработать изображение", None
+        cv2img, decode_scale = decoded
         
-        faces = detect_faces(cv2img)
+        found = None
+        if faces is None:
+            check_deadline(deadline)
+            try:
+                faces = detect_faces(cv2img)
+            except FaceServiceUnavailable:
+                return "поиск лиц сейчас недоступен, попробуйте позже", None
+            found = [f.scaled(1 / decode_scale) for f in faces]
+        else:
+            faces = [f.scaled(decode_scale) for f in faces]
+        check_deadline(deadline)
 
         if len(faces) == 0:
-            return "лица не обнаружены"
+            return "лица не обнаружены", found
         if len(faces) < face_num + 1:
-            return "такого лица нет"
+            return "такого лица нет", found
         
+        # размеры ниже — в единицах раскладки (растянутая картинка),
+        # в пиксели холста их переводит контекст из tg_canvas
         src_surf = image_surface_from_cv2_img(cv2img)
-        img_surf, scale = scale_dims(src_surf)
-        img_w, img_h = img_surf.get_width(), img_surf.get_height()
+        scale = upscale_factor(src_surf.get_width(), src_surf.get_height())
+        img_w = max(1, int(src_surf.get_width() * scale))
+        img_h = max(1, int(src_surf.get_height() * scale))
+        bubble_h = int(TacticalHandler._BUBBLE_HEIGHT_K * img_h)
         
         line_width = scale_norm(TacticalHandler._LINE_WIDTH_K, img_w, img_h)
         face_width = faces[face_num].x2 - faces[face_num].x1
@@ -80,40 +113,41 @@ class TacticalHandler(Handler):
             cr.line_to(x2, y2)
             cr.line_to(x3, y3)
 
-        fill_cr = cairo.Context(img_surf)
-        fill_cr.set_source_rgb(1, 1, 1) # white
-        draw_triangle(fill_cr, y1=0.0, y3=0.0)
-        fill_cr.close_path()
-        fill_cr.fill()
-
-        stroke_cr = cairo.Context(img_surf)
-        stroke_cr.set_line_width(line_width)
-        stroke_cr.set_source_rgb(0, 0, 0) # black
-        stroke_cr.line_to(0.0, line_width * 0.5)
-        draw_triangle(stroke_cr)
-        stroke_cr.line_to(img_w, line_width * 0.5)
-        stroke_cr.stroke()
-
-        bubble_h = int(TacticalHandler._BUBBLE_HEIGHT_K * img_h)
-        out_surf = cairo.ImageSurface(cairo.FORMAT_ARGB32, img_w, img_h + bubble_h)
-        cr = cairo.Context(out_surf)
+        # холст сразу в итоговом для Telegram размере
+        out_surf, cr = tg_canvas(img_w, img_h + bubble_h)
 
         # полоса
         cr.set_source_rgb(1, 1, 1)
         cr.rectangle(0, 0, img_w, bubble_h)
         cr.fill()
 
-        # исходное изображение ниже полосы
-        cr.set_source_surface(img_surf, 0, bubble_h)
-        cr.paint()
+        # исходное изображение ниже полосы, хвост облачка обрезается по его границам
+        cr.save()
+        cr.translate(0, bubble_h)
+        cr.rectangle(0, 0, img_w, img_h)
+        cr.clip()
+        paint_scaled(cr, src_surf, 0, 0, scale)
+
+        cr.set_source_rgb(1, 1, 1) # white
+        cr.new_path()
+        draw_triangle(cr, y1=0.0, y3=0.0)
+        cr.close_path()
+        cr.fill()
+
+        cr.set_line_width(line_width)
+        cr.set_source_rgb(0, 0, 0) # black
+        cr.new_path()
+        cr.line_to(0.0, line_width * 0.5)
+        draw_triangle(cr)
+        cr.line_to(img_w, line_width * 0.5)
+        cr.stroke()
+        cr.restore()
 
-        final_surf = scale_for_tg(out_surf)
-        buf = io.BytesIO()
-        final_surf.write_to_png(buf)
-        return buf.getvalue()
+        check_deadline(deadline)
+        return SharedImage.from_encoded(encode_surface(out_surf)), found
 
     async def _handle(self, message: Message) -> None:
-        photo = fetch_image_from_message(message)
+        photo = fetch_image_from_message(message, TacticalHandler._TARGET_SIZE)
         if not photo:
             await message.answer("нужно прикрепить пикчу")
             return
@@ -128,16 +162,50 @@ class TacticalHandler(Handler):
                 await message.answer("напишите номер лица")
                 return
 
-        stream = await self._bot.download(photo)
-        if not stream:
-            await message.answer('не удалось скачать пикчу')
+        render_key = ("tactical", photo.file_unique_id, face_num)
+        if await self._renders.answer_cached(message, render_key, "ваша пикча"):
             return
-        pic = await asyncio.get_running_loop().run_in_executor(None, stream.read)
-        result = await asyncio.get_running_loop().run_in_executor(executor, self.process_image, pic, face_num)
 
-        if isinstance(result, bytes):
-            await message.answer_photo(BufferedInputFile(result, "default"),
-                                        caption="ваша пикча")
+        faces_key = self._faces.key(photo.file_unique_id)
+        faces = await self._faces.get(faces_key)
+        # по закэшированным лицам ответ известен без скачивания и воркера
+        if faces is not None and len(faces) == 0:
+            await message.answer("лица не обнаружены")
+            return
+        if faces is not None and len(faces) < face_num + 1:
+            await message.answer("такого лица нет")
+            return
+
+        try:
+            job = self._scheduler.reserve(message.chat.id, deadline_for(message, self._DEADLINE))
+        except RenderBusyError as e:
+            await message.answer(str(e))
+            return
+        except DeadlineExceeded:
+            logging.info(f"dropped stale /tactical in chat {message.chat.id}")
+            return
+
+        with job:
+            pic_handle = await download_to_shm(self._bot, photo)
+            if pic_handle is None:
+                await message.answer('не удалось скачать пикчу')
+                return
+            try:
+                result, found = await job.run(self.process_image, pic_handle, face_num, faces, job.deadline)
+            except DeadlineExceeded:
+                logging.info(f"dropped stale /tactical in chat {message.chat.id}")
+                return
+            finally:
+                job.when_idle(release, pic_handle)
+        # сегмент с картинкой забираем до любого await, иначе при отмене он останется в /dev/shm
+        encoded = result.take() if isinstance(result, SharedImage) else None
+        if found is not None:
+            await self._faces.put(faces_key, found)
+
+        if encoded is not None:
+            sent = await message.answer_photo(BufferedInputFile(encoded.data, encoded.filename),
+                                              caption="ваша пикча")
+            self._renders.remember_sent(render_key, sent)
         elif isinstance(result, str):
             await message.answer(result)
         else:
@@ -16,6 +16,7 @@
 import os
 from aiogram import Dispatcher, Bot
 from aiogram.types import BotCommand
+import logging
 
 from bot.handlers.ping import PingHandler
 from bot.handlers.pin import PinHandler
@@ -26,6 +27,7 @@ from bot.handlers.cp import CPHandler
 from bot.handlers.demotivator import DemotivatorHandler
 from bot.handlers.start import StartHandler
 from bot.handler import Handler
+from bot.command_router import CommandRouter
 
 import re
 
@@ -40,13 +42,20 @@ async def route(dp: Dispatcher,
                 static_path: str,
                 db_path: str) -> None:
     
+    # единственный getMe за запуск: дальше bot.me() отдаёт закэшированный ответ
+    me = await bot.me()
+    if me.username is None:
+        raise RuntimeError("Cannnot fetch bot's username")
+    CommandRouter.of(dp).username = me.username
+
     omon_db_file = os.path.join(db_path, 'omon.db')
+    faces_db_file = os.path.join(db_path, 'faces.db')
 
     handlers: list[Handler] = [
-      OmonHandler(dp, bot, static_path, omon_db_file),
+      OmonHandler(dp, bot, static_path, omon_db_file, faces_db_file),
       ConfigOmonHandler(dp, bot, static_path, omon_db_file),
       DemotivatorHandler(dp, bot),
-      TacticalHandler(dp, bot),
+      TacticalHandler(dp, bot, faces_db_file),
       PinHandler(dp, bot),
       CPHandler(dp, bot),
       PingHandler(dp, bot),
@@ -62,4 +71,9 @@ async def route(dp: Dispatcher,
             continue
         commands.append(BotCommand(command=name, description=handler.description))
     
-    await bot.set_my_commands(commands)
+    # список команд меняется только с релизами, перезаписывать его на каждом старте незачем.
+    # Сравниваем пары, а не модели: у пришедших из API BotCommand привязан _bot
+    published = [(c.command, c.description) for c in await bot.get_my_commands()]
+    if published != [(c.command, c.description) for c in commands]:
+        await bot.set_my_commands(commands)
+        logging.info(f"published {len(commands)} bot commands")
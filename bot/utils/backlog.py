@@ -0,0 +1,135 @@
+# Copyright (C) 2025 nouveaubot contributors
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Апдейты, накопившиеся пока бот лежал. Их забираем до start_polling и подтверждаем,
+# чтобы поллинг начинал сразу со свежих. Старые выбрасываем, точные повторы рендера
+# от одного человека в одном чате схлопываем в последний, а остаток скармливаем
+# диспетчеру с ограниченной скоростью и только когда очередь рендера пуста —
+# новые сообщения обслуживаются раньше хвоста.
+
+import asyncio
+import logging
+import time
+from os import environ
+from typing import Any, Hashable
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Message, Update
+
+from bot.utils.render_scheduler import RenderScheduler
+
+_ENABLED = environ.get("BOT_BACKLOG", "1") != "0"
+_MAX_AGE = float(environ.get("BOT_BACKLOG_MAX_AGE", "300"))  # 0 — не выбрасывать по возрасту
+_COALESCE = environ.get("BOT_BACKLOG_COALESCE", "1") != "0"
+_RATE = float(environ.get("BOT_BACKLOG_RATE", "5"))  # апдейтов в секунду
+_BATCH = 100
+
+
+# схлопываются только рендеры: повтор той же картинки с тем же текстом ничего не добавляет.
+# Команды, меняющие состояние (config_omon, pin), и всё прочее идут как есть
+_RENDER_COMMANDS = {"omon", "омон", "dem", "дем", "tactical", "tact", "боевая", "бой"}
+
+
+def _attachment_id(message: Message | None) -> str | None:
+    if message is None:
+        return None
+    if message.photo:
+        return message.photo[-1].file_unique_id
+    media = message.document or message.sticker or message.animation
+    return media.file_unique_id if media is not None else None
+
+
+def _coalesce_key(update: Update) -> Hashable | None:
+    message = update.message
+    if message is None or message.from_user is None:
+        return None
+    text = (message.text or message.caption or "").lstrip()
+    if not text.startswith("/"):
+        return None
+    head, _, rest = text[1:].partition(" ")
+    command = head.split("@", 1)[0].lower()
+    # /omon_ukrf — тот же рендер с суффиксом кодекса
+    if command not in _RENDER_COMMANDS and command.split("_", 1)[0] not in _RENDER_COMMANDS:
+        return None
+    reply = message.reply_to_message
+    return (
+        message.chat.id,
+        message.from_user.id,
+        command,
+        " ".join(rest.split()),
+        (reply.text or reply.caption) if reply is not None else None,
+        _attachment_id(message),
+        _attachment_id(reply),
+    )
+
+
+def select(updates: list[Update], now: float) -> list[Update]:
+    fresh = [
+        u for u in updates
+        if _MAX_AGE <= 0 or u.message is None or now - u.message.date.timestamp() <= _MAX_AGE
+    ]
+    if not _COALESCE:
+        return fresh
+    # идём с конца: из повторов остаётся последний, на его месте в очереди
+    seen: set[Hashable] = set()
+    kept: list[Update] = []
+    for u in reversed(fresh):
+        key = _coalesce_key(u)
+        if key is not None:
+            if key in seen:
+                continue
+            seen.add(key)
+        kept.append(u)
+    kept.reverse()
+    return kept
+
+
+async def drain(bot: Bot, dp: Dispatcher) -> list[Update]:
+    # каждый следующий getUpdates с offset подтверждает предыдущую пачку;
+    # неполная пачка — хвост кончился, остальное уже заберёт поллинг
+    if not _ENABLED:
+        return []
+    allowed = dp.resolve_used_update_types()
+    updates: list[Update] = []
+    offset: int | None = None
+    while True:
+        batch = await bot.get_updates(offset=offset, limit=_BATCH, timeout=0, allowed_updates=allowed)
+        if not batch:
+            break
+        updates += batch
+        offset = batch[-1].update_id + 1
+        if len(batch) < _BATCH:
+            await bot.get_updates(offset=offset, limit=1, timeout=0, allowed_updates=allowed)
+            break
+
+    kept = select(updates, time.time())
+    if updates:
+        logging.info(f"backlog: {len(updates)} pending updates, replaying {len(kept)}")
+    return kept
+
+
+async def replay(bot: Bot, dp: Dispatcher, updates: list[Update]) -> None:
+    scheduler = RenderScheduler.instance()
+    interval = 1 / _RATE if _RATE > 0 else 0
+    tasks: set[asyncio.Task[Any]] = set()
+    for update in updates:
+        while scheduler.queued > 0:
+            await asyncio.sleep(interval or 0.1)
+        task = asyncio.create_task(dp.feed_update(bot, update))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        await asyncio.sleep(interval)
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -15,109 +15,109 @@
 
 import cairo
 import cv2
+import numpy as np
 import gi
 gi.require_version("Pango", "1.0")
 gi.require_version("PangoCairo", "1.0")
 from gi.repository import Pango, PangoCairo
 
 import math
+from dataclasses import dataclass
 
 _MAX_DIM_SUM = 10_000
 _MIN_RATIO = 0.05 # 1:20
 
-def _fix_ratio_if_needed(surface: cairo.ImageSurface) -> cairo.ImageSurface:
-    w, h = surface.get_width(), surface.get_height()
-    if w <= 0 or h <= 0:
-        return surface
-    r = w / h
-    min_r = _MIN_RATIO
-    max_r = 1.0 / _MIN_RATIO
-
-    if min_r <= r <= max_r:
-        return surface
+@dataclass
+class TgGeometry:
+    width: int       # итоговый холст в пикселях
+    height: int
+    scale: float     # единицы раскладки -> пиксели холста
+    offset_x: float  # поля (в пикселях), если пришлось исправлять пропорции
+    offset_y: float
 
-    # Нужно дорисовать поля
-    if r < min_r:
-        new_w = int(math.ceil(h * min_r))
-        new_h = h
-    else:
-        new_w = w
-        new_h = int(math.ceil(w * min_r))
-
-    # Чёрный фон
-    fmt = surface.get_format()
-    out = cairo.ImageSurface(fmt, new_w, new_h)
-    ctx = cairo.Context(out)
-    ctx.set_source_rgb(0, 0, 0)
-    ctx.rectangle(0, 0, new_w, new_h)
-    ctx.fill()
-
-    # Рисуем исходное изображение по центру
-    offset_x = (new_w - w) / 2.0
-    offset_y = (new_h - h) / 2.0
-    ctx.set_source_surface(surface, offset_x, offset_y)
-    ctx.paint()
-
-    return out
-
-def _fix_dim_sum_if_needed(surface: cairo.ImageSurface) -> cairo.ImageSurface:
-    w = surface.get_width()
-    h = surface.get_height()
-    dim_sum = w + h
-    if dim_sum <= _MAX_DIM_SUM:
-        return surface
-
-    r = w / h  # > 0 для корректных изображений
-
-    # Решение системы:
-    # w + h = _MAX_DIM_SUM, w / h = r
-    # h = _MAX_DIM_SUM / (r + 1), w = _MAX_DIM_SUM - h
-    new_h = _MAX_DIM_SUM / (r + 1.0)
-    new_w = _MAX_DIM_SUM - new_h
-
-    # округляем к целым и страхуемся от нулей
-    new_w_i = max(1, int(round(new_w)))
-    new_h_i = max(1, int(round(new_h)))
-
-    fmt = surface.get_format()
-    out = cairo.ImageSurface(fmt, new_w_i, new_h_i)
-    ctx = cairo.Context(out)
-
-    sx = new_w_i / w
-    sy = new_h_i / h
-    ctx.scale(sx, sy)
 
+def tg_geometry(w: float, h: float) -> TgGeometry:
+    # те же правила, что раньше применялись к готовой картинке:
+    # пропорции не хуже 1:20 (чёрные поля) и сумма сторон не больше _MAX_DIM_SUM,
+    # но считаются до рисования, чтобы рисовать сразу в итоговом размере
+    pad_w, pad_h = float(w), float(h)
+    r = w / h
+    if r < _MIN_RATIO:
+        pad_w = math.ceil(h * _MIN_RATIO)
+    elif r > 1.0 / _MIN_RATIO:
+        pad_h = math.ceil(w * _MIN_RATIO)
+
+    k = 1.0
+    if pad_w + pad_h > _MAX_DIM_SUM:
+        k = _MAX_DIM_SUM / (pad_w + pad_h)
+
+    return TgGeometry(
+        width=max(1, int(round(pad_w * k))),
+        height=max(1, int(round(pad_h * k))),
+        scale=k,
+        offset_x=(pad_w - w) / 2.0 * k,
+        offset_y=(pad_h - h) / 2.0 * k,
+    )
+
+
+def tg_canvas(w: float, h: float) -> tuple[cairo.ImageSurface, cairo.Context]:
+    # холст под Telegram для содержимого w x h (в единицах раскладки);
+    # контекст уже сдвинут и отмасштабирован, рисовать можно в единицах раскладки
+    g = tg_geometry(w, h)
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, g.width, g.height)
+    cr = cairo.Context(surface)
+    if g.offset_x or g.offset_y:
+        cr.set_source_rgb(0, 0, 0)
+        cr.paint()
+    cr.translate(g.offset_x, g.offset_y)
+    cr.scale(g.scale, g.scale)
+    return surface, cr
+
+
+def paint_scaled(cr: cairo.Context, surface: cairo.ImageSurface, x: float, y: float, scale: float) -> None:
+    # одно пересэмплирование исходника прямо на холст, без промежуточной поверхности
+    cr.save()
+    cr.translate(x, y)
+    cr.scale(scale, scale)
     pattern = cairo.SurfacePattern(surface)
-    pattern.set_filter(cairo.FILTER_BILINEAR)
-    ctx.set_source(pattern)
-    ctx.paint()
-
-    return out
-
-def scale_for_tg(surface: cairo.ImageSurface) -> cairo.ImageSurface:
-    surface = _fix_ratio_if_needed(surface)
-    surface = _fix_dim_sum_if_needed(surface)
-    return surface
+    pattern.set_filter(cairo.FILTER_GOOD)
+    cr.set_source(pattern)
+    cr.rectangle(0, 0, surface.get_width(), surface.get_height())
+    cr.fill()
+    cr.restore()
 
 
 def image_surface_from_cv2_img(cv2img: cv2.typing.MatLike) -> cairo.ImageSurface:
+    # пиксели конвертируются сразу в буфер с выравниванием, которого ждёт cairo,
+    # и этот же numpy-буфер становится памятью поверхности — без tobytes()/bytearray()
     if cv2img is None:
         raise ValueError("cv2img is None")
-    if len(cv2img.shape) == 2:
-        cv2img = cv2.cvtColor(cv2img, cv2.COLOR_GRAY2BGRA)
-    elif cv2img.shape[2] == 3:
-        cv2img = cv2.cvtColor(cv2img, cv2.COLOR_BGR2BGRA)
-    elif cv2img.shape[2] == 4:
-        pass
-    else:
-        raise ValueError("Unsupported image format")
     h, w = cv2img.shape[:2]
-    if not cv2img.flags["C_CONTIGUOUS"]:
-        cv2img = cv2img.copy()
-    stride = w * 4
-    data = cv2img.tobytes()
-    surf = cairo.ImageSurface.create_for_data(bytearray(data), cairo.FORMAT_ARGB32, w, h, stride)
-    return surf
+    stride = cairo.ImageSurface.format_stride_for_width(cairo.FORMAT_ARGB32, w)
+
+    if len(cv2img.shape) == 3 and cv2img.shape[2] == 4 \
+            and cv2img.flags["C_CONTIGUOUS"] and cv2img.flags["WRITEABLE"] and stride == w * 4:
+        buf = cv2img
+    else:
+        buf = np.empty((h, stride), np.uint8)
+        dst = buf[:, :w * 4].reshape(h, w, 4)
+        if len(cv2img.shape) == 2:
+            cv2.cvtColor(cv2img, cv2.COLOR_GRAY2BGRA, dst=dst)
+        elif cv2img.shape[2] == 3:
+            cv2.cvtColor(cv2img, cv2.COLOR_BGR2BGRA, dst=dst)
+        elif cv2img.shape[2] == 4:
+            dst[...] = cv2img
+        else:
+            raise ValueError("Unsupported image format")
+
+    # pycairo держит ссылку на buf, пока жива поверхность
+    return cairo.ImageSurface.create_for_data(buf.data, cairo.FORMAT_ARGB32, w, h, stride)
+
+def cv2_img_from_image_surface(surface: cairo.ImageSurface) -> np.ndarray:
+    # BGRA-представление поверхности без копирования (ARGB32 в little-endian лежит как BGRA)
+    surface.flush()
+    h, w, stride = surface.get_height(), surface.get_width(), surface.get_stride()
+    return np.ndarray((h, w, 4), np.uint8, buffer=surface.get_data(), strides=(stride, 4, 1))
 
 def layout_text(cr: cairo.Context,
                 text: str,
@@ -138,24 +138,9 @@ def layout_text(cr: cairo.Context,
     w, h = layout.get_pixel_size()
     return layout, w, h
 
-def scale_dims(surface: cairo.ImageSurface, min_dim: int = 512) -> tuple[cairo.ImageSurface, float]:
-    w, h = surface.get_width(), surface.get_height()
+def upscale_factor(w: int, h: int, min_dim: int = 512) -> float:
+    # во сколько раз растянуть картинку, чтобы меньшая сторона была не меньше min_dim
     img_dim = min(w, h)
-    scale = 1.0
-    if img_dim * scale < min_dim:
-        scale *= min_dim / (img_dim * scale)
-    else:
-        return surface, scale
-    
-    scaled_w = max(1, int(w * scale))
-    scaled_h = max(1, int(h * scale))
-
-    # рабочая поверхность: рисуем отмасштабированное изображение на ней
-    work_surf = cairo.ImageSurface(cairo.FORMAT_ARGB32, scaled_w, scaled_h)
-    work_cr = cairo.Context(work_surf)
-    work_cr.save()
-    work_cr.scale(scale, scale)
-    work_cr.set_source_surface(surface, 0, 0)
-    work_cr.paint()
-    work_cr.restore()
-    return work_surf, scale
+    if img_dim < min_dim:
+        return min_dim / img_dim
+    return 1.0
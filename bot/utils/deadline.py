@@ -0,0 +1,51 @@
+# Copyright (C) 2025 nouveaubot contributors
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Дедлайн — unix-время, после которого ответ на команду уже никому не нужен.
+# Считается от message.date, поэтому работает и для апдейтов, пролежавших
+# в очереди Telegram, пока бот был выключен. None — без дедлайна.
+
+import time
+from os import environ
+
+from aiogram.types import Message
+
+Deadline = float | None
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def deadline_seconds(command: str) -> float:
+    # BOT_DEADLINE_<КОМАНДА> перекрывает общий BOT_DEADLINE; 0 — не ограничивать
+    default = environ.get("BOT_DEADLINE", "120")
+    return float(environ.get(f"BOT_DEADLINE_{command.upper()}", default))
+
+
+def deadline_for(message: Message, seconds: float) -> Deadline:
+    if seconds <= 0:
+        return None
+    return message.date.timestamp() + seconds
+
+
+def expired(deadline: Deadline) -> bool:
+    return deadline is not None and time.time() > deadline
+
+
+def check_deadline(deadline: Deadline) -> None:
+    # вызывается воркером между стадиями: декодирование, детекция, рендер, кодирование
+    if expired(deadline):
+        raise DeadlineExceeded()
@@ -13,13 +13,16 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import glob
+import hashlib
+import os
 import numpy as np
-import insightface
 import cv2
 from dataclasses import dataclass
+from os import environ
+from typing import Any, Callable
 
-_detector = insightface.app.FaceAnalysis(providers=['CPUExecutionProvider'])
-_detector.prepare(ctx_id=0, det_size=(640, 640))
+_Detector = Callable[[cv2.typing.MatLike], np.ndarray]
 
 @dataclass
 class Box:
@@ -28,6 +31,129 @@ class Box:
     x2: int
     y2: int
 
+    def scaled(self, k: float) -> "Box":
+        return Box(int(self.x1 * k), int(self.y1 * k), int(self.x2 * k), int(self.y2 * k))
+
+@dataclass(frozen=True)
+class DetectorConfig:
+    detection_only: bool
+    model_pack: str
+    model_root: str
+    det_model: str | None   # явный путь к ONNX детектора вместо файла из пака
+    int8: bool
+    intra_op_threads: int   # 0 — на усмотрение onnxruntime
+    inter_op_threads: int
+    graph_optimization: str
+    det_sizes: tuple[int, ...]  # набор входных размеров детектора, по возрастанию
+
+    @staticmethod
+    def from_env() -> "DetectorConfig":
+        return DetectorConfig(
+            detection_only=environ.get("BOT_FACE_DETECTION_ONLY", "1") != "0",
+            model_pack=environ.get("BOT_FACE_MODEL_PACK", "buffalo_l"),
+            model_root=environ.get("BOT_FACE_MODEL_ROOT", "~/.insightface"),
+            det_model=environ.get("BOT_FACE_DET_MODEL") or None,
+            int8=environ.get("BOT_FACE_DET_INT8", "0") == "1",
+            intra_op_threads=int(environ.get("BOT_ORT_INTRA_THREADS", "0")),
+            inter_op_threads=int(environ.get("BOT_ORT_INTER_THREADS", "0")),
+            graph_optimization=environ.get("BOT_ORT_GRAPH_OPT", "all"),
+            det_sizes=tuple(sorted(int(x) for x in environ.get("BOT_FACE_DET_SIZES", "160,320,480,640").split(","))),
+        )
+
+    def signature(self) -> str:
+        # только то, что влияет на найденные рамки; потоки и уровень оптимизации не влияют
+        parts = (self.detection_only, self.model_pack, self.det_model, self.int8, self.det_sizes)
+        return hashlib.sha1(repr(parts).encode()).hexdigest()[:12]
+
+config = DetectorConfig.from_env()
+
+# создаётся лениво: модель нужна только процессу, который реально детектит
+_detector: _Detector | None = None
+
+def _session_options(cfg: DetectorConfig) -> Any:
+    import onnxruntime as ort
+    levels = {
+        "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }
+    if cfg.graph_optimization not in levels:
+        raise ValueError(f"unknown BOT_ORT_GRAPH_OPT: {cfg.graph_optimization}")
+    so = ort.SessionOptions()
+    so.graph_optimization_level = levels[cfg.graph_optimization]
+    if cfg.intra_op_threads > 0:
+        so.intra_op_num_threads = cfg.intra_op_threads
+    if cfg.inter_op_threads > 0:
+        so.inter_op_num_threads = cfg.inter_op_threads
+        so.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+    return so
+
+def _find_det_model(cfg: DetectorConfig) -> str:
+    from insightface.utils import ensure_available
+    pack_dir = ensure_available("models", cfg.model_pack, root=cfg.model_root)
+    candidates = sorted(
+        p for p in glob.glob(os.path.join(pack_dir, "*.onnx"))
+        if os.path.basename(p).startswith(("det_", "scrfd_")) and not p.endswith(".int8.onnx")
+    )
+    if not candidates:
+        raise RuntimeError(f"no detection model in {pack_dir}")
+    return candidates[0]
+
+def _quantized(path: str) -> str:
+    out = path.removesuffix(".onnx") + ".int8.onnx"
+    if not os.path.exists(out):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        # несколько воркеров могут квантовать одновременно — пишем во временный файл
+        tmp = f"{out}.{os.getpid()}.tmp"
+        quantize_dynamic(path, tmp, weight_type=QuantType.QUInt8)
+        os.replace(tmp, out)
+    return out
+
+def _pick_size(sizes: tuple[int, ...], long_side: int) -> int:
+    # наименьший размер, в который картинка влезает без уменьшения
+    for size in sizes:
+        if size >= long_side:
+            return size
+    return sizes[-1]
+
+def _create_detector(cfg: DetectorConfig) -> _Detector:
+    det_size = (cfg.det_sizes[-1], cfg.det_sizes[-1])
+
+    if not cfg.detection_only:
+        import insightface
+        app = insightface.app.FaceAnalysis(name=cfg.model_pack, root=cfg.model_root,
+                                           providers=['CPUExecutionProvider'])
+        app.prepare(ctx_id=0, det_size=det_size)
+        return lambda img: np.array([face.bbox for face in app.get(img)]).reshape(-1, 4)
+
+    # только детектор: распознавание, landmarks и genderage боту не нужны
+    import onnxruntime as ort
+    from insightface.model_zoo.retinaface import RetinaFace
+    path = cfg.det_model or _find_det_model(cfg)
+    if cfg.int8:
+        path = _quantized(path)
+    session = ort.InferenceSession(path, sess_options=_session_options(cfg),
+                                   providers=['CPUExecutionProvider'])
+    model = RetinaFace(model_file=path, session=session)
+    # у модели с фиксированной формой входа выбирать размер не из чего
+    sizes = cfg.det_sizes if model.input_size is None else (model.input_size[0],)
+    model.prepare(ctx_id=0, input_size=det_size)
+
+    def detect(img: cv2.typing.MatLike) -> np.ndarray:
+        # detect() сама вписывает картинку в input_size и возвращает рамки
+        # в координатах исходного изображения
+        size = _pick_size(sizes, max(img.shape[:2]))
+        return model.detect(img, input_size=(size, size), max_num=0, metric='default')[0][:, :4]
+
+    return detect
+
+def _get_detector() -> _Detector:
+    global _detector
+    if _detector is None:
+        _detector = _create_detector(config)
+    return _detector
+
 def detect_faces(img_data: cv2.typing.MatLike | bytes) -> list[Box]:
     if isinstance(img_data, (bytes, bytearray)):
         nparr = np.frombuffer(img_data, np.uint8)
@@ -36,5 +162,11 @@ def detect_faces(img_data: cv2.typing.MatLike | bytes) -> list[Box]:
             return []
         img_data = cv2img
 
-    faces = _detector.get(img_data)
-    return [Box(*face.bbox.astype(int)) for face in faces]
+    boxes = _get_detector()(img_data)
+    return [Box(*map(int, bbox)) for bbox in boxes]
+
+def warm_up() -> None:
+    # прогон пустых картинок инициализирует сессию onnxruntime
+    # и кэш якорей для каждого входного размера
+    for size in config.det_sizes:
+        detect_faces(np.zeros((size, size, 3), np.uint8))
@@ -0,0 +1,136 @@
+# Copyright (C) 2025 nouveaubot contributors
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Скачанные картинки лежат в небольшом пуле сегментов shared memory размером
+# с лимит загрузки. Сегменты создаются один раз и держатся открытыми, так что
+# скачивание не платит за создание, ftruncate и unlink каждый раз. Когда пул
+# занят, берётся одноразовый сегмент.
+
+import asyncio
+import logging
+from contextlib import contextmanager
+from multiprocessing.shared_memory import SharedMemory
+from os import environ
+from typing import Iterator
+
+from aiogram import Bot
+
+from bot.utils.message_data_fetchers import ImageSource
+from bot.utils.shm_transport import ShmFullError, ShmHandle, allocate, discard
+
+_MAX_BYTES = int(environ.get("BOT_MAX_DOWNLOAD_BYTES", str(20 * 1024 * 1024)))
+_TIMEOUT = float(environ.get("BOT_DOWNLOAD_TIMEOUT", "30"))
+_POOL_SIZE = int(environ.get("BOT_DOWNLOAD_POOL", "2"))
+_CHUNK_SIZE = 64 * 1024
+
+# сегменты пула по имени и те, что сейчас свободны
+_pooled: dict[str, SharedMemory] = {}
+_free: list[str] = []
+
+
+class _TooLarge(Exception):
+    pass
+
+
+def _acquire(size: int) -> tuple[str, SharedMemory]:
+    if _free:
+        name = _free.pop()
+        return name, _pooled[name]
+    if len(_pooled) < _POOL_SIZE:
+        handle, shm = allocate(_MAX_BYTES)
+        _pooled[handle.name] = shm
+        return handle.name, shm
+    handle, shm = allocate(size)
+    return handle.name, shm
+
+
+def release(handle: ShmHandle) -> None:
+    # вместо discard() для того, что вернул download_to_shm. Сегмент, отданный воркеру,
+    # возвращается только после завершения воркера (RenderJob.when_idle): иначе
+    # следующее скачивание перезапишет его под отменённой, но ещё работающей задачей
+    if handle.name in _pooled:
+        _free.append(handle.name)
+    else:
+        discard(handle)
+
+
+def close_pool() -> None:
+    for shm in _pooled.values():
+        shm.close()
+        discard(ShmHandle(shm.name, 0))
+    _pooled.clear()
+    _free.clear()
+
+
+@contextmanager
+def _segment(size: int) -> Iterator[tuple[str, SharedMemory]]:
+    # сегмент под запись; при ошибке он возвращается в пул (или удаляется)
+    name, shm = _acquire(size)
+    try:
+        yield name, shm
+    except BaseException:
+        release(ShmHandle(name, 0))
+        raise
+    finally:
+        if name not in _pooled:
+            shm.close()
+
+
+async def _stream_to_shm(bot: Bot, url: str, size: int | None) -> ShmHandle:
+    # пишем чанки прямо в сегмент, который потом уйдёт воркеру;
+    # без известного размера — до лимита загрузки
+    limit = size if size is not None else _MAX_BYTES
+    pos = 0
+    with _segment(limit) as (name, shm):
+        async for chunk in bot.session.stream_content(url, timeout=int(_TIMEOUT), chunk_size=_CHUNK_SIZE):
+            end = pos + len(chunk)
+            if end > limit:
+                raise _TooLarge(f"more than {limit} bytes")
+            shm.buf[pos:end] = chunk
+            pos = end
+    return ShmHandle(name, pos)
+
+
+async def download_to_shm(bot: Bot, source: ImageSource) -> ShmHandle | None:
+    # скачивание через HTTP-сессию aiogram (её соединения переиспользуются)
+    # сразу в shared memory; вызывающий владеет сегментом и возвращает его через release()
+    if source.file_size is not None and source.file_size > _MAX_BYTES:
+        return None
+    try:
+        async with asyncio.timeout(_TIMEOUT):
+            file = await bot.get_file(source.file_id)
+            if file.file_path is None:
+                return None
+            size = file.file_size or source.file_size
+            if size is not None and size > _MAX_BYTES:
+                return None
+
+            if bot.session.api.is_local:
+                # локальный Bot API отдаёт путь к файлу, а не URL
+                stream = await bot.download_file(file.file_path)
+                if stream is None:
+                    return None
+                data = stream.getbuffer()
+                if len(data) > _MAX_BYTES:
+                    raise _TooLarge(f"more than {_MAX_BYTES} bytes")
+                with _segment(len(data)) as (name, shm):
+                    shm.buf[:len(data)] = data
+                return ShmHandle(name, len(data))
+
+            url = bot.session.api.file_url(bot.token, file.file_path)
+            return await _stream_to_shm(bot, url, size)
+    except (TimeoutError, _TooLarge, ShmFullError) as e:
+        logging.warning(f"download of {source.file_unique_id} aborted: {e!r}")
+        return None
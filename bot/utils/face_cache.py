@@ -0,0 +1,129 @@
+# Copyright (C) 2025 nouveaubot contributors
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from os import environ
+from typing import Optional
+
+import aiosqlite
+
+from bot.utils.detect_faces import Box, config as detector_config
+
+_MAX_ITEMS = int(environ.get("BOT_FACE_CACHE_SIZE", "1024"))
+_PERSIST = environ.get("BOT_FACE_CACHE_PERSIST", "1") != "0"
+_MAX_ROWS = int(environ.get("BOT_FACE_CACHE_DB_ROWS", "100000"))
+_TRIM_EVERY = 256
+
+
+# результаты детекции по file_unique_id: LRU в памяти + необязательный SQLite рядом с omon.db
+class FaceCache:
+    _instance: Optional["FaceCache"] = None
+    _lock = threading.Lock()
+
+    _memory: "OrderedDict[str, list[Box]]"
+    _db_file: str | None
+    _db: aiosqlite.Connection | None
+    _db_lock: asyncio.Lock
+    _puts: int
+    _signature: str
+
+    # ---------- singleton factory ----------
+    @classmethod
+    def instance(cls, db_file: str) -> "FaceCache":
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = cls(db_file if _PERSIST else None)
+        return cls._instance
+
+    def __init__(self, db_file: str | None) -> None:
+        self._memory = OrderedDict()
+        self._db_file = db_file
+        self._db = None
+        self._db_lock = asyncio.Lock()
+        self._puts = 0
+        self._signature = detector_config.signature()
+
+    def key(self, file_unique_id: str) -> str:
+        # рамки зависят от модели и входных размеров, поэтому конфигурация детектора входит в ключ
+        return f"{file_unique_id}:{self._signature}"
+
+    def _remember(self, key: str, boxes: list[Box]) -> None:
+        self._memory[key] = boxes
+        self._memory.move_to_end(key)
+        while len(self._memory) > _MAX_ITEMS:
+            self._memory.popitem(last=False)
+
+    async def _connection(self) -> aiosqlite.Connection | None:
+        if self._db_file is None:
+            return None
+        async with self._db_lock:
+            if self._db is None:
+                db = await aiosqlite.connect(self._db_file)
+                await db.execute("PRAGMA journal_mode = WAL")
+                await db.execute("PRAGMA synchronous = NORMAL")
+                await db.execute(
+                    "CREATE TABLE IF NOT EXISTS faces ("
+                    "  key        TEXT PRIMARY KEY NOT NULL,"
+                    "  boxes      TEXT NOT NULL,"
+                    "  created_at INTEGER NOT NULL"
+                    ")"
+                )
+                await db.execute("CREATE INDEX IF NOT EXISTS idx_faces_created_at ON faces(created_at)")
+                await db.commit()
+                self._db = db
+        return self._db
+
+    async def get(self, key: str) -> list[Box] | None:
+        boxes = self._memory.get(key)
+        if boxes is not None:
+            self._memory.move_to_end(key)
+            return boxes
+
+        db = await self._connection()
+        if db is None:
+            return None
+        cur = await db.execute("SELECT boxes FROM faces WHERE key = ?", (key,))
+        row = await cur.fetchone()
+        if row is None:
+            return None
+        boxes = [Box(*b) for b in json.loads(row[0])]
+        self._remember(key, boxes)
+        return boxes
+
+    async def put(self, key: str, boxes: list[Box]) -> None:
+        self._remember(key, boxes)
+
+        db = await self._connection()
+        if db is None:
+            return
+        await db.execute(
+            "INSERT OR REPLACE INTO faces(key, boxes, created_at) VALUES (?, ?, ?)",
+            (key, json.dumps([[b.x1, b.y1, b.x2, b.y2] for b in boxes]), int(time.time())),
+        )
+        self._puts += 1
+        if self._puts % _TRIM_EVERY == 0:
+            await db.execute(
+                "DELETE FROM faces WHERE key IN ("
+                "  SELECT key FROM faces ORDER BY created_at"
+                "  LIMIT max(0, (SELECT COUNT(*) FROM faces) - ?)"
+                ")",
+                (_MAX_ROWS,),
+            )
+        await db.commit()
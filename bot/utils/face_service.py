@@ -0,0 +1,217 @@
+# Copyright (C) 2025 nouveaubot contributors
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Отдельный процесс, который владеет детектором лиц. Рабочие процессы рендера
+# ходят к нему по unix-сокету, а он обрабатывает запросы по очереди. Так в памяти
+# живёт одна копия модели. Пачек нет: у SCRFD из buffalo_l нет batch-оси, и окно
+# сбора только добавляло бы задержку к каждой детекции.
+# Упавший сервис (например, убитый OOM-киллером) перезапускается из главного процесса,
+# а воркеры, пока его нет, отказывают сразу, а не держат рендер до таймаута.
+
+import logging
+import multiprocessing as mp
+import os
+import queue
+import tempfile
+import threading
+import time
+from multiprocessing.connection import Client, Connection, Listener
+from multiprocessing.process import BaseProcess
+from os import environ
+
+import cv2
+import numpy as np
+
+from bot.utils.detect_faces import Box
+from bot.utils import detect_faces as _local
+
+_ENABLED = environ.get("BOT_FACE_SERVICE", "1") != "0"
+_ADDRESS = environ.get("BOT_FACE_SERVICE_SOCKET") or os.path.join(tempfile.gettempdir(), "nouveaubot-faces.sock")
+_CONNECT_TIMEOUT = 30.0  # при старте воркера: сервис может ещё подниматься
+_RECONNECT_TIMEOUT = float(environ.get("BOT_FACE_RECONNECT_TIMEOUT", "5"))  # на перезапуск сервиса
+_DOWN_COOLDOWN = 5.0  # столько после неудачного подключения запросы отказывают без попыток
+_RESTART_BACKOFF_MAX = 30.0
+
+_Request = tuple[Connection, cv2.typing.MatLike | bytes]
+
+
+class FaceServiceUnavailable(RuntimeError):
+    pass
+
+
+def _authkey() -> bytes:
+    # authkey наследуется всеми дочерними процессами multiprocessing,
+    # так что сервис и воркеры пула знают его без явной передачи
+    return bytes(mp.current_process().authkey)
+
+
+def _reader(conn: Connection, requests: "queue.Queue[_Request]") -> None:
+    try:
+        while True:
+            requests.put((conn, conn.recv()))
+    except (EOFError, OSError):
+        pass
+
+
+def _acceptor(listener: Listener, requests: "queue.Queue[_Request]") -> None:
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception as e:
+            logging.warning(f"face service: rejected connection: {e}")
+            continue
+        threading.Thread(target=_reader, args=(conn, requests), daemon=True).start()
+
+
+def _serve(address: str) -> None:
+    if os.path.exists(address):
+        os.unlink(address)
+    requests: "queue.Queue[_Request]" = queue.Queue()
+    listener = Listener(address, family="AF_UNIX", authkey=_authkey())
+    threading.Thread(target=_acceptor, args=(listener, requests), daemon=True).start()
+
+    # сокет уже слушает, поэтому запросы, пришедшие во время загрузки модели, просто ждут в очереди
+    _local.warm_up()
+
+    while True:
+        conn, img = requests.get()
+        try:
+            result: list[Box] | Exception = _local.detect_faces(img)
+        except Exception as e:
+            result = RuntimeError(f"face detection failed: {e}")
+        try:
+            conn.send(result)
+        except OSError:
+            pass
+
+
+class FaceService:
+    _process: BaseProcess | None = None
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def _spawn(self) -> None:
+        ctx = mp.get_context("spawn")
+        self._process = ctx.Process(
+            target=_serve,
+            args=(_ADDRESS,),
+            name="face-service",
+            daemon=True,
+        )
+        self._process.start()
+
+    def start(self) -> None:
+        if not _ENABLED or self._process is not None:
+            return
+        self._stopping.clear()
+        self._spawn()
+        threading.Thread(target=self._supervise, name="face-service-supervisor", daemon=True).start()
+
+    def _supervise(self) -> None:
+        backoff = 1.0
+        started = time.monotonic()
+        while not self._stopping.is_set():
+            process = self._process
+            if process is None:
+                return
+            process.join(timeout=1.0)
+            if process.is_alive() or self._stopping.is_set():
+                continue
+
+            # проживший дольше минуты сервис падает не в цикле — перезапускаем сразу
+            if time.monotonic() - started > 60:
+                backoff = 1.0
+            logging.error(f"face service exited with code {process.exitcode}, restarting in {backoff:.0f}s")
+            if self._stopping.wait(backoff):
+                return
+            backoff = min(backoff * 2, _RESTART_BACKOFF_MAX)
+            with self._lock:
+                if self._stopping.is_set():
+                    return
+                self._spawn()
+                started = time.monotonic()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        with self._lock:
+            if self._process is None:
+                return
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+        if os.path.exists(_ADDRESS):
+            os.unlink(_ADDRESS)
+
+
+# ---------- клиентская часть (работает внутри воркеров пула) ----------
+
+_conn: Connection | None = None
+_down_until = 0.0
+
+
+def _connect(timeout: float) -> Connection:
+    # сокет слушает с первых секунд жизни сервиса, поэтому отказ в соединении дольше
+    # timeout значит, что сервис лежит, а не грузит модель
+    global _down_until
+    if time.monotonic() < _down_until:
+        raise FaceServiceUnavailable("face service is down")
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return Client(_ADDRESS, family="AF_UNIX", authkey=_authkey())
+        except (OSError, EOFError) as e:
+            # нет сокета, отказ или сброс посреди рукопожатия — сервис ещё не поднялся
+            if time.monotonic() > deadline:
+                _down_until = time.monotonic() + _DOWN_COOLDOWN
+                raise FaceServiceUnavailable("face service is not running") from e
+            time.sleep(0.1)
+
+
+def detect_faces(img_data: cv2.typing.MatLike | bytes) -> list[Box]:
+    if not _ENABLED:
+        return _local.detect_faces(img_data)
+
+    global _conn
+    for attempt in range(2):
+        if _conn is None:
+            _conn = _connect(_RECONNECT_TIMEOUT)
+        try:
+            _conn.send(img_data)
+            result = _conn.recv()
+            break
+        except (EOFError, OSError):
+            # сервис перезапустился или соединение порвалось — пробуем ещё раз
+            _conn.close()
+            _conn = None
+            if attempt:
+                raise FaceServiceUnavailable("face service connection lost")
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def warm_up() -> None:
+    # в режиме сервиса ждёт, пока сервис загрузит модель; иначе грузит её локально.
+    # Недоступный сервис воркер не валит: подключение повторится при первом запросе
+    global _conn
+    if _ENABLED and _conn is None:
+        try:
+            _conn = _connect(_CONNECT_TIMEOUT)
+        except FaceServiceUnavailable as e:
+            logging.warning(f"face service: warm-up skipped: {e}")
+            return
+    detect_faces(np.zeros((64, 64, 3), np.uint8))
@@ -0,0 +1,118 @@
+# Copyright (C) 2025 nouveaubot contributors
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import struct
+from os import environ
+
+import cv2
+import numpy as np
+
+_MAX_PIXELS = int(environ.get("BOT_MAX_IMAGE_PIXELS", "50000000"))
+# меньшая сторона после уменьшения — не меньше, чем растягивает upscale_factor,
+# иначе широкая или высокая картинка потом растягивается обратно и мылится
+_MIN_SIDE = 512
+
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_JPEG_NO_LENGTH = {0x01, 0xD8} | set(range(0xD0, 0xD8))
+
+
+class ImageTooLargeError(ValueError):
+    pass
+
+
+def _jpeg_dims(data: bytes | bytearray | memoryview) -> tuple[int, int] | None:
+    i = 2
+    n = len(data)
+    while i + 9 < n:
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # заполняющие байты
+            i += 1
+            continue
+        if marker in _JPEG_SOF:
+            h, w = struct.unpack_from(">HH", data, i + 5)
+            return w, h
+        if marker in _JPEG_NO_LENGTH:
+            i += 2
+            continue
+        (length,) = struct.unpack_from(">H", data, i + 2)
+        i += 2 + length
+    return None
+
+
+def _webp_dims(data: bytes | bytearray | memoryview) -> tuple[int, int] | None:
+    chunk = bytes(data[12:16])
+    if chunk == b"VP8 " and len(data) >= 30:
+        w, h = struct.unpack_from("<HH", data, 26)
+        return w & 0x3FFF, h & 0x3FFF
+    if chunk == b"VP8L" and len(data) >= 25:
+        b0, b1, b2, b3 = data[21], data[22], data[23], data[24]
+        return 1 + (b0 | (b1 & 0x3F) << 8), 1 + ((b1 >> 6) | b2 << 2 | (b3 & 0x0F) << 10)
+    if chunk == b"VP8X" and len(data) >= 30:
+        w = int.from_bytes(data[24:27], "little") + 1
+        h = int.from_bytes(data[27:30], "little") + 1
+        return w, h
+    return None
+
+
+def image_dims(data: bytes | bytearray | memoryview) -> tuple[int, int] | None:
+    # размеры из заголовка, без декодирования пикселей; None — формат не распознан
+    head = bytes(data[:16])
+    if head.startswith(b"\x89PNG\r\n\x1a\n") and len(data) >= 24:
+        return struct.unpack_from(">II", data, 16)
+    if head.startswith(b"\xff\xd8"):
+        return _jpeg_dims(data)
+    if head.startswith(b"RIFF") and head[8:12] == b"WEBP":
+        return _webp_dims(data)
+    if head.startswith((b"GIF87a", b"GIF89a")) and len(data) >= 10:
+        return struct.unpack_from("<HH", data, 6)
+    if head.startswith(b"BM") and len(data) >= 26:
+        w, h = struct.unpack_from("<ii", data, 18)
+        return abs(w), abs(h)
+    return None
+
+
+def decode_image(data: bytes | bytearray | memoryview,
+                 target: int | None = None) -> tuple[cv2.typing.MatLike, float] | None:
+    # возвращает картинку и её масштаб относительно оригинала (1, 1/2, 1/4 или 1/8);
+    # если длинная сторона всё равно больше target, а короткая — не меньше _MIN_SIDE,
+    # декодируем сразу уменьшенной
+    dims = image_dims(data)
+    flag, reduction = cv2.IMREAD_COLOR, 1
+    if dims is not None:
+        w, h = dims
+        if w * h > _MAX_PIXELS:
+            raise ImageTooLargeError(f"{w}x{h} exceeds {_MAX_PIXELS} pixels")
+        if target is not None:
+            for r, reduced_flag in _REDUCED_FLAGS:
+                if max(w, h) // r >= target and min(w, h) // r >= _MIN_SIDE:
+                    flag, reduction = reduced_flag, r
+                    break
+
+    # без локальной ссылки на np.frombuffer: буфер может быть shared memory,
+    # которую вызывающий закроет сразу после возврата (или исключения)
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+    if img is None:
+        return None
+    if dims is None and img.shape[0] * img.shape[1] > _MAX_PIXELS:
+        raise ImageTooLargeError(f"{img.shape[1]}x{img.shape[0]} exceeds {_MAX_PIXELS} pixels")
+    return img, 1 / reduction
@@ -0,0 +1,102 @@
+# Copyright (C) 2025 nouveaubot contributors
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import math
+from dataclasses import dataclass
+from os import environ
+
+import cairo
+import cv2
+import numpy as np
+
+from bot.utils.cairo_helpers import cv2_img_from_image_surface
+
+# auto — JPEG для фото, PNG для картинок из нескольких плоских цветов
+_FORMAT = environ.get("BOT_OUTPUT_FORMAT", "auto")
+_MAX_BYTES = int(environ.get("BOT_OUTPUT_MAX_BYTES", "1000000"))
+_QUALITY = int(environ.get("BOT_OUTPUT_QUALITY", "90"))
+_MIN_QUALITY = int(environ.get("BOT_OUTPUT_MIN_QUALITY", "50"))
+_SEARCH_STEPS = 4
+
+_FLAT_SAMPLES = 65536
+_FLAT_MAX_COLORS = 256
+
+_LOSSY = {
+    "jpeg": (".jpg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+
+
+@dataclass
+class EncodedImage:
+    data: bytes
+    filename: str
+
+
+def _is_flat(img: np.ndarray) -> bool:
+    # считаем цвета на прореженной сетке: у фото их тысячи, у плоской графики — единицы
+    h, w = img.shape[:2]
+    step = max(1, int(math.sqrt(h * w / _FLAT_SAMPLES)))
+    sample = img[::step, ::step, :3].reshape(-1, 3).astype(np.uint32)
+    packed = sample[:, 0] << 16 | sample[:, 1] << 8 | sample[:, 2]
+    return len(np.unique(packed)) <= _FLAT_MAX_COLORS
+
+
+def _imencode(img: np.ndarray, ext: str, params: list[int]) -> bytes:
+    ok, buf = cv2.imencode(ext, img, params)
+    if not ok:
+        raise RuntimeError(f"cv2.imencode({ext}) failed")
+    return buf.tobytes()
+
+
+def _encode_lossy(img: np.ndarray, ext: str, param: int) -> bytes:
+    # обычно хватает одного прохода; иначе бинарный поиск максимального качества,
+    # которое укладывается в бюджет байтов
+    data = _imencode(img, ext, [param, _QUALITY])
+    if len(data) <= _MAX_BYTES:
+        return data
+
+    lo, hi = _MIN_QUALITY, _QUALITY - 1
+    best: bytes | None = None
+    for _ in range(_SEARCH_STEPS):
+        if lo > hi:
+            break
+        q = (lo + hi) // 2
+        data = _imencode(img, ext, [param, q])
+        if len(data) <= _MAX_BYTES:
+            best, lo = data, q + 1
+        else:
+            hi = q - 1
+    if best is None:
+        best = _imencode(img, ext, [param, _MIN_QUALITY])
+    return best
+
+
+def encode_surface(surface: cairo.ImageSurface) -> EncodedImage:
+    img = cv2_img_from_image_surface(surface)
+    fmt = _FORMAT
+    if fmt == "auto":
+        fmt = "png" if _is_flat(img) else "jpeg"
+
+    if fmt == "png":
+        bgr = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+        return EncodedImage(_imencode(bgr, ".png", [cv2.IMWRITE_PNG_COMPRESSION, 3]), "image.png")
+    if fmt not in _LOSSY:
+        raise ValueError(f"unknown BOT_OUTPUT_FORMAT: {fmt}")
+
+    ext, param = _LOSSY[fmt]
+    # JPEG не умеет альфу, а холсты у нас непрозрачные
+    bgr = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR) if fmt == "jpeg" else img
+    return EncodedImage(_encode_lossy(bgr, ext, param), "image" + ext)
@@ -13,16 +13,45 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from aiogram.types import Message, PhotoSize
+from aiogram.types import Document, Message, PhotoSize, Sticker
 
+# то, что можно скачать и декодировать через cv2.imdecode
+ImageSource = PhotoSize | Document | Sticker
 
-def _photo_from_msg(m: Message) -> PhotoSize | None:
+# getFile в Bot API не отдаёт файлы больше 20 МБ
+_TG_DOWNLOAD_LIMIT = 20 * 1024 * 1024
+_DECODABLE_MIME = ("image/jpeg", "image/png", "image/webp", "image/bmp", "image/tiff")
+_DECODABLE_EXTS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff")
+
+
+def _long_side(p: PhotoSize) -> int:
+    return max(p.width, p.height)
+
+
+def _adequate(p: PhotoSize | None, target: int) -> bool:
+    return p is not None and _long_side(p) >= target
+
+
+def _smallest_adequate(sizes: list[PhotoSize], target: int) -> PhotoSize:
+    # наименьший вариант, который не меньше target по длинной стороне; иначе самый большой
+    by_size = sorted(sizes, key=_long_side)
+    for p in by_size:
+        if _long_side(p) >= target:
+            return p
+    return by_size[-1]
+
+
+def _downloadable(file_size: int | None) -> bool:
+    return file_size is None or file_size <= _TG_DOWNLOAD_LIMIT
+
+
+def _photo_from_msg(m: Message, target: int) -> ImageSource | None:
     IMAGE_MIME_PREFIXES = ("image/",)
     IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff", ".gif")
 
     # 1) Native photos
     if m.photo:
-        return m.photo[-1]
+        return _smallest_adequate(m.photo, target)
 
     # 2) Animations/GIFs (as animation or as document)
     if m.animation and m.animation.thumbnail:
@@ -31,15 +60,24 @@ def _photo_from_msg(m: Message) -> PhotoSize | None:
     if m.document:
         mt = (m.document.mime_type or "").lower()
         fn = (m.document.file_name or "").lower()
-        if (
-            m.document.thumbnail
-            and (mt.startswith(IMAGE_MIME_PREFIXES) or fn.endswith(IMAGE_EXTS))
-        ):
-            return m.document.thumbnail
+        if mt.startswith(IMAGE_MIME_PREFIXES) or fn.endswith(IMAGE_EXTS):
+            if _adequate(m.document.thumbnail, target):
+                return m.document.thumbnail
+            # превью мелкое или его нет — берём оригинал, если cv2 его прочитает
+            if (mt in _DECODABLE_MIME or fn.endswith(_DECODABLE_EXTS)) and _downloadable(m.document.file_size):
+                return m.document
+            if m.document.thumbnail:
+                return m.document.thumbnail
 
     # 3) Stickers (static/animated/video) — use thumbnail if present
-    if m.sticker and m.sticker.thumbnail:
-        return m.sticker.thumbnail
+    if m.sticker:
+        if _adequate(m.sticker.thumbnail, target):
+            return m.sticker.thumbnail
+        # статичный стикер — это webp, его можно декодировать напрямую
+        if not m.sticker.is_animated and not m.sticker.is_video:
+            return m.sticker
+        if m.sticker.thumbnail:
+            return m.sticker.thumbnail
 
     # 4) Videos with a poster (sometimes people send short GIF-like videos)
     if m.video and m.video.thumbnail:
@@ -52,12 +90,14 @@ def _photo_from_msg(m: Message) -> PhotoSize | None:
     return None
 
 
-def fetch_image_from_message(msg: Message) -> PhotoSize | None:
-    r = _photo_from_msg(msg)
+def fetch_image_from_message(msg: Message, target: int = 1280) -> ImageSource | None:
+    # target — желаемая длинная сторона в пикселях: больше качать незачем,
+    # всё равно уменьшится при подготовке к отправке
+    r = _photo_from_msg(msg, target)
     if r is not None:
         return r
     if msg.reply_to_message:
-        return _photo_from_msg(msg.reply_to_message)
+        return _photo_from_msg(msg.reply_to_message, target)
     return None
 
 
@@ -13,13 +13,23 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import logging
+import os
+import random
+import re
 import sqlite3
+import time
 import aiosqlite
 from aiosqlitepool import SQLiteConnectionPool
 from dataclasses import dataclass
-from typing import Optional
+from os import environ
+from typing import Collection, Optional
 import threading
 
+# как часто сверяться со счётчиком изменений (omon_generation): записи других процессов
+# становятся видны не позже чем через столько секунд, свои — сразу
+_CACHE_CHECK_INTERVAL = float(environ.get("BOT_OMON_CACHE_CHECK", "2"))
+
 
 @dataclass
 class CodeRecord:
@@ -34,6 +44,13 @@ class OmonDB:
 
     _pool: SQLiteConnectionPool
     _initialized: bool = False
+
+    # кэш чтений; сбрасывается своими записями и сменой omon_generation
+    _code_ids: dict[tuple[int | None, str | None], int]
+    _codes: dict[int, list[CodeRecord]]
+    _sentences: dict[int, dict[str, str]]
+    _generation: int | None
+    _checked_at: float
     _pragmas: list[str] = [
         "PRAGMA foreign_keys = ON",
         "PRAGMA journal_mode = WAL",
@@ -45,33 +62,70 @@ class OmonDB:
 
     # ---------- singleton factory ----------
     @classmethod
-    def instance(cls, db_file: str, sql_path: str) -> "OmonDB":
+    def instance(cls, db_file: str, migrations_path: str) -> "OmonDB":
         if cls._instance is None:
             with cls._lock:
                 if cls._instance is None:
-                    cls._instance = cls(db_file, sql_path)
+                    cls._instance = cls(db_file, migrations_path)
         return cls._instance
 
     # ---------- ctor (sync init + pool) ----------
-    def __init__(self, db_file: str, sql_path: str) -> None:
+    def __init__(self, db_file: str, migrations_path: str) -> None:
         if self._initialized:
             return  # guard against double __init__
-        self._init_db_sync(db_file, sql_path)
+        self._init_db_sync(db_file, migrations_path)
         self._pool = self._make_pool(db_file)
+        self._code_ids = {}
+        self._codes = {}
+        self._sentences = {}
+        self._generation = None
+        self._checked_at = float("-inf")
         self._initialized = True
 
-    def _init_db_sync(self, db_file: str, sql_path: str) -> None:
-        with open(sql_path, "r", encoding="utf-8") as f:
-            script = f.read()
-        conn = sqlite3.connect(db_file)
+    def _init_db_sync(self, db_file: str, migrations_path: str) -> None:
+        # миграции — файлы NNN_*.sql; применяются только те, чей номер больше PRAGMA user_version,
+        # каждая в своей транзакции вместе с новым user_version. На тёплом старте — пара чтений
+        conn = sqlite3.connect(db_file, isolation_level=None)
         try:
             for pragma in self._pragmas:
                 conn.execute(pragma)
-            conn.executescript(script)
-            conn.commit()
+            self._migrate(conn, migrations_path)
+            self._seed_default(conn, migrations_path)
         finally:
             conn.close()
 
+    @staticmethod
+    def _run_in_transaction(conn: sqlite3.Connection, script: str) -> None:
+        # при ошибке незакоммиченная транзакция откатывается при закрытии соединения
+        conn.executescript(f"BEGIN IMMEDIATE;\n{script}\nCOMMIT;")
+
+    def _migrate(self, conn: sqlite3.Connection, migrations_path: str) -> None:
+        t = time.perf_counter()
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        migrations = sorted(
+            (int(m.group(1)), name)
+            for name in os.listdir(migrations_path)
+            if (m := re.fullmatch(r"(\d+)_\w+\.sql", name))
+        )
+        for number, name in migrations:
+            if number <= version:
+                continue
+            step = time.perf_counter()
+            with open(os.path.join(migrations_path, name), "r", encoding="utf-8") as f:
+                script = f.read()
+            self._run_in_transaction(conn, f"{script}\nPRAGMA user_version = {number};")
+            version = number
+            logging.info(f"omon db: applied {name} in {(time.perf_counter() - step) * 1000:.1f} ms")
+        logging.info(f"omon db: schema version {version}, migrations took {(time.perf_counter() - t) * 1000:.1f} ms")
+
+    def _seed_default(self, conn: sqlite3.Connection, migrations_path: str) -> None:
+        if conn.execute("SELECT 1 FROM codes WHERE chat_id IS NULL AND code_name = 'ukrf'").fetchone():
+            return
+        t = time.perf_counter()
+        with open(os.path.join(migrations_path, "ukrf.sql"), "r", encoding="utf-8") as f:
+            self._run_in_transaction(conn, f.read())
+        logging.info(f"omon db: seeded default code ukrf in {(time.perf_counter() - t) * 1000:.1f} ms")
+
     def _make_pool(self, db_file: str) -> SQLiteConnectionPool:
         async def connection_factory() -> aiosqlite.Connection:
             conn = await aiosqlite.connect(db_file)
@@ -82,25 +136,65 @@ class OmonDB:
 
         return SQLiteConnectionPool(connection_factory=connection_factory)  # pyright: ignore[reportArgumentType]
 
+    # ---------- cache ----------
+    def _clear_cache(self) -> None:
+        self._code_ids.clear()
+        self._codes.clear()
+        self._sentences.clear()
+
+    async def _validate_cache(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < _CACHE_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        async with self._pool.connection() as c:
+            cur = await c.execute("SELECT value FROM omon_generation")
+            row = await cur.fetchone()
+        generation = int(row["value"]) if row else 0
+        if generation != self._generation:
+            self._clear_cache()
+            self._generation = generation
+
+    def _forget_chat(self, chat_id: int) -> None:
+        self._codes.pop(chat_id, None)
+        for key in [k for k in self._code_ids if k[0] == chat_id]:
+            del self._code_ids[key]
+
+    def _forget_sentences(self, code_id: int) -> None:
+        self._sentences.pop(code_id, None)
+        # в списках кодексов лежат счётчики статей, а чат кодекса здесь неизвестен
+        self._codes.clear()
+
+    # ---------- queries ----------
     async def get_codes(self, chat_id: int) -> list[CodeRecord]:
+        await self._validate_cache()
+        cached = self._codes.get(chat_id)
+        if cached is not None:
+            return list(cached)
+
         async with self._pool.connection() as c:
             cur = await c.execute(
-                """
-                SELECT codes.id, codes.code_name, COUNT(codes_sentences.id) AS sentences_count
-                FROM codes
-                LEFT JOIN codes_sentences ON codes.id = codes_sentences.code_id
-                WHERE codes.chat_id = ?
-                GROUP BY codes.id, codes.code_name
-                ORDER BY codes.code_name
-                """,
+                "SELECT id, code_name, n_sentences FROM codes WHERE chat_id = ? ORDER BY code_name",
                 (chat_id,),
             )
             rows = await cur.fetchall()
-            return [CodeRecord(r["id"], r["code_name"], r["sentences_count"]) for r in rows]
+        codes = [CodeRecord(r["id"], r["code_name"], r["n_sentences"]) for r in rows]
+        self._codes[chat_id] = codes
+        return list(codes)
 
     async def get_or_default_code_id(
         self, chat_id: int | None, code_name: str | None
     ) -> int:
+        await self._validate_cache()
+        key = (chat_id, code_name)
+        cached = self._code_ids.get(key)
+        if cached is not None:
+            return cached
+        code_id = await self._query_code_id(chat_id, code_name)
+        self._code_ids[key] = code_id
+        return code_id
+
+    async def _query_code_id(self, chat_id: int | None, code_name: str | None) -> int:
         async with self._pool.connection() as c:
             if chat_id is not None and code_name is not None:
                 cur = await c.execute(
@@ -118,13 +212,68 @@ class OmonDB:
             return int(row["id"])
 
     async def load_sentences(self, code_id: int) -> dict[str, str]:
+        # возвращается общий закэшированный словарь — менять его нельзя
+        await self._validate_cache()
+        cached = self._sentences.get(code_id)
+        if cached is not None:
+            return cached
+
         async with self._pool.connection() as c:
             cur = await c.execute(
                 "SELECT sentence_name, sentence_description FROM codes_sentences WHERE code_id = ?",
                 (code_id,),
             )
             rows = await cur.fetchall()
-            return {r["sentence_name"]: r["sentence_description"] for r in rows}
+        sentences = {r["sentence_name"]: r["sentence_description"] for r in rows}
+        self._sentences[code_id] = sentences
+        return sentences
+
+    async def find_sentences(self, code_id: int, names: Collection[str]) -> dict[str, str]:
+        # описания только запрошенных статей; ненайденных в ответе нет
+        if not names:
+            return {}
+        await self._validate_cache()
+        cached = self._sentences.get(code_id)
+        if cached is not None:
+            return {n: cached[n] for n in names if n in cached}
+
+        placeholders = ",".join("?" * len(names))
+        async with self._pool.connection() as c:
+            cur = await c.execute(
+                "SELECT sentence_name, sentence_description FROM codes_sentences "
+                f"WHERE code_id = ? AND sentence_name IN ({placeholders})",
+                (code_id, *names),
+            )
+            rows = await cur.fetchall()
+        return {r["sentence_name"]: r["sentence_description"] for r in rows}
+
+    @staticmethod
+    def _pick_ords(n: int, excluded: set[int], k: int) -> list[int]:
+        # k случайных номеров из 1..n, кроме excluded; если их меньше k — все
+        # в случайном порядке (вызывающий берёт первые), а остаток добирается повторами
+        pool_size = n - len(excluded)
+        if pool_size <= 0:
+            return []
+        if pool_size <= k:
+            pool = [o for o in range(1, n + 1) if o not in excluded]
+            return random.sample(pool, pool_size) + random.choices(pool, k=k - pool_size)
+        picks: list[int] = []
+        while len(picks) < k:
+            o = random.randint(1, n)
+            if o not in excluded and o not in picks:
+                picks.append(o)
+        return picks
+
+    async def sample_sentences(
+        self, code_id: int, k: int, exclude: Collection[str] = ()
+    ) -> list[tuple[str, str]]:
+        # k случайных статей кодекса, кроме exclude (см. _pick_ords). Кодекс (не больше
+        # 500 статей) читается в кэш целиком при первом обращении, дальше выбор — в памяти
+        if k <= 0:
+            return []
+        items = list((await self.load_sentences(code_id)).items())
+        skip = {i + 1 for i, (name, _) in enumerate(items) if name in exclude}
+        return [items[o - 1] for o in self._pick_ords(len(items), skip, k)]
 
     async def create_code(self, chat_id: int, code_name: str) -> None:
         async with self._pool.connection() as c:
@@ -133,15 +282,20 @@ class OmonDB:
                 (chat_id, code_name),
             )
             await c.commit() # pyright: ignore[reportAttributeAccessIssue]
+        self._forget_chat(chat_id)
 
     async def delete_code(self, chat_id: int, code_name: str) -> int:
         async with self._pool.connection() as c:
             cur = await c.execute(
-                "DELETE FROM codes WHERE chat_id = ? AND code_name = ?",
+                "DELETE FROM codes WHERE chat_id = ? AND code_name = ? RETURNING id",
                 (chat_id, code_name),
             )
+            rows = await cur.fetchall()
             await c.commit() # pyright: ignore[reportAttributeAccessIssue]
-            return cur.rowcount
+        self._forget_chat(chat_id)
+        for r in rows:
+            self._sentences.pop(int(r["id"]), None)
+        return len(rows)
 
     async def upsert_sentence(
         self, code_id: int, sentence_name: str, sentence_description: str
@@ -154,6 +308,26 @@ class OmonDB:
                 (code_id, sentence_name, sentence_description),
             )
             await c.commit() # pyright: ignore[reportAttributeAccessIssue]
+        self._forget_sentences(code_id)
+
+    async def upsert_sentences(self, code_id: int, sentences: list[tuple[str, str]]) -> None:
+        # пачка статей одним executemany в одной транзакции: один fsync вместо сотни;
+        # если сработал лимит или другой триггер — не записывается ничего
+        if not sentences:
+            return
+        async with self._pool.connection() as c:
+            try:
+                await c.executemany(
+                    "INSERT INTO codes_sentences(code_id, sentence_name, sentence_description) "
+                    "VALUES (?, ?, ?) "
+                    "ON CONFLICT(code_id, sentence_name) DO UPDATE SET sentence_description=excluded.sentence_description",
+                    [(code_id, name, desc) for name, desc in sentences],
+                )
+                await c.commit() # pyright: ignore[reportAttributeAccessIssue]
+            except Exception:
+                await c.rollback() # pyright: ignore[reportAttributeAccessIssue]
+                raise
+        self._forget_sentences(code_id)
 
     async def delete_sentence(self, code_id: int, sentence_name: str) -> int:
         async with self._pool.connection() as c:
@@ -162,4 +336,5 @@ class OmonDB:
                 (code_id, sentence_name),
             )
             await c.commit() # pyright: ignore[reportAttributeAccessIssue]
-            return cur.rowcount
\ No newline at end of file
+        self._forget_sentences(code_id)
+        return cur.rowcount
\ No newline at end of file
@@ -13,6 +13,43 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
+import logging
+import os
+import time
 from concurrent.futures import ProcessPoolExecutor
+from os import environ
 
-executor = ProcessPoolExecutor()
\ No newline at end of file
+MAX_WORKERS = int(environ.get("BOT_RENDER_WORKERS", "0")) or (os.cpu_count() or 1)
+
+# сколько занял initializer этого воркера (заполняется внутри воркера)
+_init_seconds = 0.0
+
+
+def _init_worker() -> None:
+    global _init_seconds
+    t = time.perf_counter()
+    # детектор (или соединение с сервисом детекции) поднимается здесь,
+    # до первой задачи, а не в главном процессе при импорте хендлеров
+    # Ошибка здесь не должна ронять воркер: упавший initializer ломает весь пул, и вместе
+    # с /omon и /tactical отказал бы /dem. Детектор догрузится при первом запросе
+    try:
+        from bot.utils.face_service import warm_up
+        warm_up()
+    except Exception:
+        logging.exception("render worker: face detector warm-up failed")
+    _init_seconds = time.perf_counter() - t
+
+
+def _worker_info() -> tuple[int, float]:
+    return os.getpid(), _init_seconds
+
+
+executor = ProcessPoolExecutor(max_workers=MAX_WORKERS, initializer=_init_worker)
+
+
+async def warm_up_workers() -> list[tuple[int, float]]:
+    # пока свободных воркеров нет, каждый submit запускает новый процесс,
+    # так что MAX_WORKERS задач поднимают весь пул
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(*(loop.run_in_executor(executor, _worker_info) for _ in range(MAX_WORKERS)))
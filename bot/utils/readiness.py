@@ -0,0 +1,43 @@
+# Copyright (C) 2025 nouveaubot contributors
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Бот готов, когда хендлеры подключены, воркеры и модель прогреты и начат приём апдейтов.
+# Готовность видна как файл (для healthcheck в compose) и, в режиме вебхука, как /healthz.
+
+import os
+import tempfile
+from os import environ
+
+READY_FILE = environ.get("BOT_READY_FILE", os.path.join(tempfile.gettempdir(), "nouveaubot.ready"))
+
+_ready = False
+
+
+def is_ready() -> bool:
+    return _ready
+
+
+def set_ready(ready: bool) -> None:
+    global _ready
+    _ready = ready
+    if ready:
+        with open(READY_FILE, "w") as f:
+            f.write(f"{os.getpid()}\n")
+    else:
+        # файл мог остаться от прошлого запуска контейнера
+        try:
+            os.remove(READY_FILE)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,86 @@
+# Copyright (C) 2025 nouveaubot contributors
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+import time
+from collections import OrderedDict
+from os import environ
+from typing import Hashable, Optional
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message
+
+_MAX_ITEMS = int(environ.get("BOT_RENDER_CACHE_SIZE", "1024"))
+_TTL = float(environ.get("BOT_RENDER_CACHE_TTL", "86400"))
+
+# (команда, file_unique_id входной картинки, нормализованные аргументы...)
+RenderKey = tuple[Hashable, ...]
+
+
+# file_id уже отправленных детерминированных рендеров: повтор — один вызов API без рендера и аплоада
+class RenderCache:
+    _instance: Optional["RenderCache"] = None
+    _lock = threading.Lock()
+
+    _entries: "OrderedDict[RenderKey, tuple[str, float]]"
+
+    # ---------- singleton factory ----------
+    @classmethod
+    def instance(cls) -> "RenderCache":
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def __init__(self) -> None:
+        self._entries = OrderedDict()
+
+    def get(self, key: RenderKey) -> str | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        file_id, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return file_id
+
+    def put(self, key: RenderKey, file_id: str) -> None:
+        self._entries[key] = (file_id, time.monotonic() + _TTL)
+        self._entries.move_to_end(key)
+        while len(self._entries) > _MAX_ITEMS:
+            self._entries.popitem(last=False)
+
+    def drop_command(self, command: str) -> None:
+        for key in [k for k in self._entries if k[0] == command]:
+            del self._entries[key]
+
+    async def answer_cached(self, message: Message, key: RenderKey, caption: str) -> bool:
+        file_id = self.get(key)
+        if file_id is None:
+            return False
+        try:
+            await message.answer_photo(file_id, caption=caption)
+        except TelegramBadRequest:
+            # file_id протух или недоступен — забываем и рендерим заново
+            self._entries.pop(key, None)
+            return False
+        return True
+
+    def remember_sent(self, key: RenderKey, sent: Message) -> None:
+        if sent.photo:
+            self.put(key, sent.photo[-1].file_id)
@@ -0,0 +1,230 @@
+# Copyright (C) 2025 nouveaubot contributors
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Очередь перед пулом рендера. В пул одновременно уходит не больше MAX_WORKERS задач,
+# остальные ждут здесь, разложенные по чатам; свободный воркер получает задачу
+# следующего по кругу чата, поэтому один спамящий чат не задерживает остальных.
+# Место в очереди занимается до скачивания картинки, так что лимит ограничивает
+# и память под ожидающие картинки.
+
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from os import environ
+from typing import Any, Callable, Optional
+
+from bot.utils.deadline import Deadline, DeadlineExceeded, expired
+from bot.utils.pool_executor import MAX_WORKERS, executor
+from bot.utils.shm_transport import SharedImage, discard
+
+_QUEUE_MAX = int(environ.get("BOT_RENDER_QUEUE_MAX", str(MAX_WORKERS * 4)))
+_CHAT_QUEUE_MAX = int(environ.get("BOT_RENDER_CHAT_QUEUE_MAX", "3"))
+_CHAT_WORKERS = int(environ.get("BOT_RENDER_CHAT_WORKERS", "0")) or max(1, MAX_WORKERS // 2)
+
+
+def _discard_result(result: Any) -> None:
+    for item in result if isinstance(result, tuple) else (result,):
+        if isinstance(item, SharedImage):
+            discard(item.handle)
+
+
+class RenderBusyError(Exception):
+    # текст исключения — готовый ответ пользователю
+    pass
+
+
+@dataclass
+class _Task:
+    job: "RenderJob"
+    fn: Callable[..., Any]
+    args: tuple[Any, ...]
+    future: asyncio.Future[Any]
+
+
+@dataclass
+class _ChatState:
+    reserved: int = 0   # места в очереди, ещё не отданные пулу
+    running: int = 0
+    ready: deque[_Task] = field(default_factory=deque)
+
+
+class RenderJob:
+    # место в очереди; run() можно вызывать несколько раз подряд (например, детекция,
+    # затем рендер) — каждый вызов снова встаёт в очередь своего чата
+    def __init__(self, scheduler: "RenderScheduler", chat_id: int, deadline: Deadline) -> None:
+        self._scheduler = scheduler
+        self._chat_id = chat_id
+        self.deadline = deadline
+        self._held = True
+        self._workers = 0
+        self._on_idle: list[tuple[Callable[..., Any], tuple[Any, ...]]] = []
+
+    def __enter__(self) -> "RenderJob":
+        return self
+
+    def __exit__(self, *_exc: object) -> None:
+        # место не дошло до пула (ошибка скачивания, отмена) — возвращаем его
+        if self._held:
+            self._held = False
+            self._scheduler._release(self._chat_id)
+
+    def when_idle(self, fn: Callable[..., Any], *args: Any) -> None:
+        # fn(*args), когда у запроса не осталось работающих воркеров (сразу, если их нет).
+        # После отмены или дедлайна воркер может ещё читать входной буфер —
+        # переиспользовать его можно только отсюда
+        if self._workers:
+            self._on_idle.append((fn, args))
+        else:
+            fn(*args)
+
+    def _worker_done(self) -> None:
+        self._workers -= 1
+        if not self._workers:
+            callbacks, self._on_idle = self._on_idle, []
+            for fn, args in callbacks:
+                fn(*args)
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        if not self._held:
+            # запрос уже прошёл проверку лимитов в reserve(), повторно не отказываем
+            self._scheduler._rereserve(self._chat_id)
+            self._held = True
+        future: asyncio.Future[Any] = asyncio.get_running_loop().create_future()
+        task = _Task(self, fn, args, future)
+        self._scheduler._enqueue(self._chat_id, task)
+        try:
+            return await future
+        finally:
+            if self._held:
+                # отменили, пока задача ждала в очереди
+                self._held = False
+                self._scheduler._withdraw(self._chat_id, task)
+
+
+class RenderScheduler:
+    _instance: Optional["RenderScheduler"] = None
+    _lock = threading.Lock()
+
+    _chats: "OrderedDict[int, _ChatState]"
+
+    # ---------- singleton factory ----------
+    @classmethod
+    def instance(cls) -> "RenderScheduler":
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def __init__(self) -> None:
+        self._chats = OrderedDict()
+        self._reserved = 0
+        self._running = 0
+
+    @property
+    def queued(self) -> int:
+        # задачи, которые заняли место, но ещё не попали в пул
+        return self._reserved
+
+    def reserve(self, chat_id: int, deadline: Deadline = None) -> RenderJob:
+        # бросает RenderBusyError сразу, не дожидаясь, пока очередь рассосётся;
+        # просроченный запрос не занимает места и не скачивает картинку
+        if expired(deadline):
+            raise DeadlineExceeded()
+        if self._reserved >= _QUEUE_MAX:
+            raise RenderBusyError("бот перегружен, попробуйте чуть позже")
+        state = self._chats.setdefault(chat_id, _ChatState())
+        if state.reserved >= _CHAT_QUEUE_MAX:
+            raise RenderBusyError("слишком много пикч из этого чата, подождите")
+        state.reserved += 1
+        self._reserved += 1
+        return RenderJob(self, chat_id, deadline)
+
+    def _enqueue(self, chat_id: int, task: _Task) -> None:
+        self._chats[chat_id].ready.append(task)
+        self._pump()
+
+    def _rereserve(self, chat_id: int) -> None:
+        self._chats.setdefault(chat_id, _ChatState()).reserved += 1
+        self._reserved += 1
+
+    def _release(self, chat_id: int) -> None:
+        state = self._chats[chat_id]
+        state.reserved -= 1
+        self._reserved -= 1
+        self._forget_if_idle(chat_id)
+
+    def _withdraw(self, chat_id: int, task: _Task) -> None:
+        state = self._chats[chat_id]
+        if task in state.ready:
+            state.ready.remove(task)
+        self._release(chat_id)
+
+    def _forget_if_idle(self, chat_id: int) -> None:
+        state = self._chats.get(chat_id)
+        if state is not None and not state.reserved and not state.running:
+            del self._chats[chat_id]
+
+    def _next_task(self) -> tuple[int, _Task] | None:
+        # первый по кругу чат с готовой задачей и свободной квотой воркеров;
+        # обслуженный чат уходит в конец круга
+        for chat_id, state in self._chats.items():
+            if state.ready and state.running < _CHAT_WORKERS:
+                self._chats.move_to_end(chat_id)
+                return chat_id, state.ready.popleft()
+        return None
+
+    def _pump(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._running < MAX_WORKERS:
+            picked = self._next_task()
+            if picked is None:
+                return
+            chat_id, task = picked
+            task.job._held = False
+            state = self._chats[chat_id]
+            state.reserved -= 1
+            self._reserved -= 1
+            if task.future.cancelled() or expired(task.job.deadline):
+                # пока ждали воркера, ответ стал не нужен — воркер не трогаем
+                if not task.future.done():
+                    task.future.set_exception(DeadlineExceeded())
+                self._forget_if_idle(chat_id)
+                continue
+            state.running += 1
+            self._running += 1
+            task.job._workers += 1
+            worker = loop.run_in_executor(executor, task.fn, *task.args)
+            worker.add_done_callback(lambda f, c=chat_id, t=task: self._finished(c, t, f))
+
+    def _finished(self, chat_id: int, task: _Task, worker: asyncio.Future[Any]) -> None:
+        state = self._chats[chat_id]
+        state.running -= 1
+        self._running -= 1
+        self._forget_if_idle(chat_id)
+        task.job._worker_done()
+        if task.future.cancelled():
+            # ответ уже никто не ждёт — сегмент с результатом удаляем сами
+            if not worker.cancelled() and worker.exception() is None:
+                _discard_result(worker.result())
+        elif not task.future.done():
+            if worker.cancelled():
+                task.future.cancel()
+            elif (exc := worker.exception()) is not None:
+                task.future.set_exception(exc)
+            else:
+                task.future.set_result(worker.result())
+        self._pump()
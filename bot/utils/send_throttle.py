@@ -0,0 +1,184 @@
+# Copyright (C) 2025 nouveaubot contributors
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Все исходящие сообщения проходят через token bucket'ы: общий на бота и по одному
+# на чат (в группах Telegram разрешает меньше, чем в личке). Очередь ожидающих
+# упорядочена по приоритету: короткие текстовые ответы уходят раньше загрузки картинок.
+# На 429 чат замораживается на retry_after, и запрос повторяется.
+
+import asyncio
+import itertools
+import logging
+import math
+import time
+from dataclasses import dataclass, field
+from os import environ
+from typing import Any
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+_GLOBAL_RATE = float(environ.get("BOT_SEND_GLOBAL_RATE", "30"))        # сообщений в секунду
+_CHAT_RATE = float(environ.get("BOT_SEND_CHAT_RATE", "1"))             # в личке, в секунду
+_GROUP_RATE = float(environ.get("BOT_SEND_GROUP_RATE", "20")) / 60     # в группе, 20 в минуту
+_CHAT_BURST = float(environ.get("BOT_SEND_CHAT_BURST", "3"))
+_RETRIES = int(environ.get("BOT_SEND_RETRIES", "3"))
+_MAX_BUCKETS = 10000
+
+# что считается исходящим сообщением; остальные методы (getFile, pin, ...) идут мимо очереди
+_SEND_PREFIXES = ("Send", "Copy", "Forward")
+# тяжёлые загрузки ждут, пока не уйдут текстовые ответы
+_LOW_PRIORITY = {"SendPhoto", "SendDocument", "SendMediaGroup", "SendAnimation", "SendVideo", "SendSticker"}
+
+
+@dataclass
+class _Bucket:
+    rate: float
+    burst: float
+    tokens: float = field(init=False)
+    updated: float = field(default_factory=time.monotonic)
+    blocked_until: float = 0.0
+
+    def __post_init__(self) -> None:
+        self.tokens = self.burst
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst and now >= self.blocked_until
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    chat_id: int | str = field(compare=False)
+    future: asyncio.Future[None] = field(compare=False)
+
+
+class SendThrottle(BaseRequestMiddleware):
+    _global: _Bucket
+    _chats: dict[int | str, _Bucket]
+    _waiters: list[_Waiter]
+
+    def __init__(self) -> None:
+        self._global = _Bucket(_GLOBAL_RATE, max(1.0, _GLOBAL_RATE))
+        self._chats = {}
+        self._waiters = []
+        self._seq = itertools.count()
+        self._wakeup: asyncio.Event | None = None
+        self._pump_task: asyncio.Task[None] | None = None
+
+    def _chat_bucket(self, chat_id: int | str) -> _Bucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= _MAX_BUCKETS:
+                now = time.monotonic()
+                self._chats = {k: v for k, v in self._chats.items() if not v.idle(now)}
+            # отрицательный id — группа или канал, у них лимит строже
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            bucket = _Bucket(_GROUP_RATE if is_group else _CHAT_RATE, _CHAT_BURST)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _acquire(self, chat_id: int | str, priority: int) -> None:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._waiters.append(_Waiter(priority, next(self._seq), chat_id, future))
+        self._wakeup.set()
+        await future
+
+    def _grant_next(self, now: float) -> float:
+        # пропускаем первого по приоритету ожидающего, чей чат может отправлять прямо сейчас;
+        # иначе — сколько ждать до ближайшего освободившегося чата
+        delay = math.inf
+        for waiter in sorted(self._waiters):
+            chat = self._chat_bucket(waiter.chat_id)
+            chat_delay = chat.wait_time(now)
+            if chat_delay == 0:
+                self._global.take()
+                chat.take()
+                waiter.future.set_result(None)
+                self._waiters.remove(waiter)
+                return 0.0
+            delay = min(delay, chat_delay)
+        return delay
+
+    async def _pump(self) -> None:
+        assert self._wakeup is not None
+        while True:
+            self._waiters = [w for w in self._waiters if not w.future.done()]
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            delay = self._global.wait_time(now) or self._grant_next(now)
+            if delay == 0:
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except TimeoutError:
+                pass
+
+    def _freeze(self, chat_id: int | str, seconds: float) -> None:
+        bucket = self._chat_bucket(chat_id)
+        bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + seconds)
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = type(method).__name__
+        chat_id: Any = getattr(method, "chat_id", None)
+        if chat_id is None or not name.startswith(_SEND_PREFIXES):
+            return await make_request(bot, method)
+
+        priority = 1 if name in _LOW_PRIORITY else 0
+        attempt = 0
+        while True:
+            await self._acquire(chat_id, priority)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                logging.warning(f"flood control in chat {chat_id}: retry after {e.retry_after}s (attempt {attempt})")
+                self._freeze(chat_id, e.retry_after)
+                if attempt > _RETRIES:
+                    raise
@@ -0,0 +1,161 @@
+# Copyright (C) 2025 nouveaubot contributors
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Картинки между главным процессом и воркерами ходят через multiprocessing.shared_memory:
+# по пайпу пула передаётся только маленький ShmHandle, а не сами байты.
+# Владелец сегмента всегда один и явно делает unlink, поэтому resource_tracker не нужен.
+# Сегменты именуются с префиксом и pid создателя: суммарный объём живых сегментов
+# ограничен (в контейнере /dev/shm маленький, переполнение — это SIGBUS),
+# а оставшиеся от упавшего процесса чистятся при старте.
+
+import logging
+import os
+import secrets
+import sys
+from contextlib import contextmanager
+from dataclasses import dataclass
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from os import environ
+from typing import Iterator
+
+from bot.utils.image_encode import EncodedImage
+
+_SHM_DIR = "/dev/shm"
+_PREFIX = "nouveaubot_"
+_MAX_BYTES = int(environ.get("BOT_SHM_MAX_BYTES", str(192 * 1024 * 1024)))
+
+
+class ShmFullError(MemoryError):
+    pass
+
+
+@dataclass(frozen=True)
+class ShmHandle:
+    name: str
+    size: int
+
+
+def _open(name: str, create: bool = False, size: int = 0) -> SharedMemory:
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, create=create, size=size, track=False)
+    shm = SharedMemory(name=name, create=create, size=size)
+    resource_tracker.unregister(shm._name, "shared_memory")  # pyright: ignore[reportAttributeAccessIssue]
+    return shm
+
+
+def _live_bytes() -> int:
+    # наши сегменты всех процессов (главного и воркеров) видны как файлы в /dev/shm
+    total = 0
+    with os.scandir(_SHM_DIR) as entries:
+        for entry in entries:
+            if entry.name.startswith(_PREFIX):
+                try:
+                    total += entry.stat().st_size
+                except FileNotFoundError:
+                    pass
+    return total
+
+
+def _check_space(size: int) -> None:
+    if not os.path.isdir(_SHM_DIR):
+        return
+    live = _live_bytes()
+    if live + size > _MAX_BYTES:
+        raise ShmFullError(f"{live} bytes already in shared memory, {size} more exceed {_MAX_BYTES}")
+    st = os.statvfs(_SHM_DIR)
+    if st.f_bavail * st.f_frsize < size:
+        raise ShmFullError(f"{_SHM_DIR} has no room for {size} bytes")
+
+
+def allocate(size: int) -> tuple[ShmHandle, SharedMemory]:
+    # сегмент под запись; вызывающий закрывает его сам, а удаляет через discard()
+    _check_space(size)
+    shm = _open(f"{_PREFIX}{os.getpid()}_{secrets.token_hex(6)}", create=True, size=max(1, size))
+    return ShmHandle(shm.name, size), shm
+
+
+def remove_stale() -> None:
+    # при старте: сегменты этого pid (остались от прошлого запуска контейнера с тем же pid)
+    # и умерших процессов никто уже не удалит
+    if not os.path.isdir(_SHM_DIR):
+        return
+    removed = 0
+    for name in os.listdir(_SHM_DIR):
+        if not name.startswith(_PREFIX):
+            continue
+        pid = name[len(_PREFIX):].split("_", 1)[0]
+        if pid.isdigit() and int(pid) != os.getpid() and os.path.exists(f"/proc/{pid}"):
+            continue
+        try:
+            os.unlink(os.path.join(_SHM_DIR, name))
+            removed += 1
+        except FileNotFoundError:
+            pass
+    if removed:
+        logging.warning(f"shm: removed {removed} stale segments")
+
+
+def share(data: bytes | bytearray | memoryview) -> ShmHandle:
+    handle, shm = allocate(len(data))
+    try:
+        shm.buf[:len(data)] = data
+    finally:
+        shm.close()
+    return handle
+
+
+@contextmanager
+def attached(handle: ShmHandle) -> Iterator[memoryview]:
+    # после выхода из блока ссылок на буфер оставаться не должно
+    shm = _open(handle.name)
+    buf = shm.buf[:handle.size]
+    try:
+        yield buf
+    finally:
+        buf.release()
+        shm.close()
+
+
+def discard(handle: ShmHandle) -> None:
+    try:
+        shm = _open(handle.name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    if sys.version_info < (3, 13):
+        # unlink() до 3.13 снимает сегмент с учёта трекера, а мы его туда не ставили
+        resource_tracker.register(shm._name, "shared_memory")  # pyright: ignore[reportAttributeAccessIssue]
+    shm.unlink()
+
+
+def take(handle: ShmHandle) -> bytes:
+    with attached(handle) as buf:
+        data = bytes(buf)
+    discard(handle)
+    return data
+
+
+@dataclass(frozen=True)
+class SharedImage:
+    handle: ShmHandle
+    filename: str
+
+    @staticmethod
+    def from_encoded(img: EncodedImage) -> "SharedImage":
+        return SharedImage(share(img.data), img.filename)
+
+    def take(self) -> EncodedImage:
+        return EncodedImage(take(self.handle), self.filename)
@@ -0,0 +1,45 @@
+# Copyright (C) 2025 nouveaubot contributors
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class StartupReport:
+    _started: float
+    _stages: list[tuple[str, float]]
+
+    def __init__(self) -> None:
+        self._started = time.perf_counter()
+        self._stages = []
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t)
+
+    def add(self, name: str, seconds: float) -> None:
+        self._stages.append((name, seconds))
+
+    def log(self) -> None:
+        total = time.perf_counter() - self._started
+        width = max((len(name) for name, _ in self._stages), default=0)
+        lines = [f"  {name:<{width}}  {seconds * 1000:9.1f} ms" for name, seconds in self._stages]
+        logging.info("startup took %.1f ms:\n%s", total * 1000, "\n".join(lines))
@@ -0,0 +1,76 @@
+# Copyright (C) 2025 nouveaubot contributors
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Режим вебхука (BOT_MODE=webhook): aiohttp-сервер за reverse proxy.
+# Telegram сразу получает 200, апдейт обрабатывается в фоновой задаче.
+# Без BOT_WEBHOOK_URL бот не трогает setWebhook, и сервер можно проверить локально:
+#   curl -H 'X-Telegram-Bot-Api-Secret-Token: <BOT_WEBHOOK_SECRET>' \
+#        -H 'Content-Type: application/json' -d @update.json http://127.0.0.1:8080/webhook
+
+import asyncio
+import logging
+from os import environ
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from bot.utils import backlog
+from bot.utils.readiness import is_ready, set_ready
+
+_URL = environ.get("BOT_WEBHOOK_URL")  # публичный адрес, который регистрируется в Telegram
+_SECRET = environ.get("BOT_WEBHOOK_SECRET") or None
+_HOST = environ.get("BOT_WEBHOOK_HOST", "0.0.0.0")
+_PORT = int(environ.get("BOT_WEBHOOK_PORT", "8080"))
+_PATH = environ.get("BOT_WEBHOOK_PATH", "/webhook")
+_HEALTH_PATH = "/healthz"
+
+
+async def _register(bot: Bot, dp: Dispatcher) -> asyncio.Task[None]:
+    # хвост апдейтов разбираем той же политикой, что и при поллинге:
+    # пока вебхук снят, getUpdates доступен
+    await bot.delete_webhook(drop_pending_updates=False)
+    pending = await backlog.drain(bot, dp)
+    await bot.set_webhook(_URL, secret_token=_SECRET, allowed_updates=dp.resolve_used_update_types())
+    return asyncio.create_task(backlog.replay(bot, dp, pending))
+
+
+async def _health(_request: web.Request) -> web.Response:
+    return web.Response(status=200 if is_ready() else 503, text="ok" if is_ready() else "starting")
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher) -> None:
+    replay: asyncio.Task[None] | None = None
+    if _URL is not None:
+        replay = await _register(bot, dp)
+    elif _SECRET is None:
+        logging.warning("webhook: BOT_WEBHOOK_SECRET is not set, requests are not authenticated")
+
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=_SECRET, handle_in_background=True).register(app, path=_PATH)
+    app.router.add_get(_HEALTH_PATH, _health)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, _HOST, _PORT).start()
+        logging.info(f"webhook: listening on {_HOST}:{_PORT}{_PATH}")
+        set_ready(True)
+        await asyncio.Event().wait()
+    finally:
+        if replay is not None:
+            replay.cancel()
+        await runner.cleanup()
@@ -17,21 +17,63 @@ from os import environ
 from aiogram import Bot, Dispatcher
 
 from bot.route import route
+from bot.utils import backlog
+from bot.utils.webhook import run_webhook
+from bot.utils.face_service import FaceService
+from bot.utils.pool_executor import warm_up_workers
+from bot.utils.startup_report import StartupReport
+from bot.utils.readiness import set_ready
+from bot.utils.send_throttle import SendThrottle
+from bot.utils.shm_transport import remove_stale
+from bot.utils.download import close_pool
 
 import asyncio
+import logging
 
 
 async def main() -> None:
+    report = StartupReport()
+    set_ready(False)
+    remove_stale()
+
     token = environ["BOT_TOKEN"]
     static_path = environ["BOT_STATIC_PATH"]
     db_path = environ["BOT_DATABASE_PATH"]
 
     bot = Bot(token)
+    bot.session.middleware(SendThrottle())
+
+    face_service = FaceService()
+    with report.stage("face service spawn"):
+        face_service.start()
+
+    try:
+        dp = Dispatcher()
+        with report.stage("route (getMe, handlers, db, commands)"):
+            await route(dp=dp, bot=bot, static_path=static_path, db_path=db_path)
+
+        with report.stage("render workers + face model"):
+            workers = await warm_up_workers()
+        for pid, seconds in workers:
+            report.add(f"  worker {pid} init", seconds)
+        report.log()
 
-    dp = Dispatcher()
-    await route(dp=dp, bot=bot, static_path=static_path, db_path=db_path)
+        if environ.get("BOT_MODE", "polling") == "webhook":
+            await run_webhook(bot, dp)
+            return
 
-    await dp.start_polling(bot)
+        pending = await backlog.drain(bot, dp)
+        replay = asyncio.create_task(backlog.replay(bot, dp, pending))
+        set_ready(True)
+        try:
+            await dp.start_polling(bot)
+        finally:
+            replay.cancel()
+    finally:
+        set_ready(False)
+        face_service.stop()
+        close_pool()
 
 if __name__ == "__main__":
+    logging.basicConfig(level=environ.get("BOT_LOG_LEVEL", "INFO"))
     asyncio.run(main())
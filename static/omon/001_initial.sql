@@ -0,0 +1,267 @@
+-- ===================== 001: initial schema (SQLite) =====================
+-- Переносит базу, созданную старым omon.sql (он выполнялся на каждом старте), на текущую схему;
+-- на пустой базе просто создаёт таблицы. Транзакцию и PRAGMA user_version выставляет OmonDB.
+
+-- на пустой базе — пустые таблицы старой схемы, чтобы копирование ниже прошло
+CREATE TABLE IF NOT EXISTS codes (
+  id        INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+  chat_id   INTEGER,
+  code_name TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS codes_sentences (
+  id                   INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+  code_id              INTEGER NOT NULL,
+  sentence_name        TEXT NOT NULL,
+  sentence_description TEXT NOT NULL
+);
+
+-- ---------- drop old triggers/indexes ----------
+DROP TRIGGER IF EXISTS trg_codes_block_ukrf_ins;
+DROP TRIGGER IF EXISTS trg_codes_block_ukrf_upd;
+DROP TRIGGER IF EXISTS trg_codes_block_ukrf_del;
+DROP TRIGGER IF EXISTS trg_codes_limit_per_chat_ins;
+DROP TRIGGER IF EXISTS trg_codes_limit_per_chat_upd;
+DROP TRIGGER IF EXISTS trg_sentences_limit_per_code_ins;
+DROP TRIGGER IF EXISTS trg_sentences_limit_per_code_upd;
+DROP TRIGGER IF EXISTS trg_codes_generation_ins;
+DROP TRIGGER IF EXISTS trg_codes_generation_upd;
+DROP TRIGGER IF EXISTS trg_codes_generation_del;
+DROP TRIGGER IF EXISTS trg_sentences_generation_ins;
+DROP TRIGGER IF EXISTS trg_sentences_generation_upd;
+DROP TRIGGER IF EXISTS trg_sentences_generation_del;
+DROP TRIGGER IF EXISTS trg_sentences_ord_ins;
+DROP TRIGGER IF EXISTS trg_sentences_ord_del;
+
+DROP INDEX IF EXISTS unq_codes_null_chat;
+DROP INDEX IF EXISTS idx_codes_chat_id;
+DROP INDEX IF EXISTS idx_sentences_code_id;
+DROP INDEX IF EXISTS idx_sentences_code_name;
+DROP INDEX IF EXISTS unq_sentences_code_ord;
+
+-- ---------- new schema ----------
+CREATE TABLE IF NOT EXISTS codes_new (
+  id        INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+  chat_id   INTEGER,
+  code_name TEXT NOT NULL
+    CHECK (code_name = lower(trim(code_name)))
+    CHECK (code_name GLOB '[a-z][a-z]*')
+    CHECK (length(code_name) BETWEEN 1 AND 32),
+  CONSTRAINT unq_codes_chat_code UNIQUE (chat_id, code_name)
+);
+
+CREATE TABLE IF NOT EXISTS codes_sentences_new (
+  id                   INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+  code_id              INTEGER NOT NULL,
+  -- номер статьи внутри кодекса, 1..n без дыр: по нему выбираются случайные статьи
+  ord                  INTEGER NOT NULL DEFAULT 0,
+  sentence_name        TEXT NOT NULL
+    CHECK (sentence_name = trim(sentence_name))
+    CHECK (length(sentence_name) BETWEEN 1 AND 64),
+  sentence_description TEXT NOT NULL
+    CHECK (sentence_description = trim(sentence_description))
+    CHECK (length(sentence_description) BETWEEN 1 AND 4096),
+  CONSTRAINT unq_sentences UNIQUE (code_id, sentence_name),
+  CONSTRAINT fk_codes_sentences_code
+    FOREIGN KEY(code_id) REFERENCES codes_new(id) ON DELETE CASCADE
+);
+
+-- ---------- copy & normalize ----------
+-- игнорируем ukrf, если он был создан с ненулевым chat_id (схема сама добавит дефолт позже)
+INSERT INTO codes_new(id, chat_id, code_name)
+SELECT id, chat_id, lower(trim(code_name))
+FROM   codes
+WHERE  NOT (lower(trim(code_name))='ukrf' AND chat_id IS NOT NULL);
+
+-- только непросиротевшие статьи
+INSERT INTO codes_sentences_new(id, code_id, ord, sentence_name, sentence_description)
+SELECT s.id, s.code_id, ROW_NUMBER() OVER (PARTITION BY s.code_id ORDER BY s.id),
+       trim(s.sentence_name), trim(s.sentence_description)
+FROM   codes_sentences s
+JOIN   codes_new c ON c.id = s.code_id;
+
+-- ---------- validate existing data (single summed assertion) ----------
+CREATE TEMP TABLE _assert(x INTEGER CHECK (x=0));
+
+CREATE TEMP VIEW _violations(v) AS
+  -- некорректные code_name
+  SELECT COUNT(*) FROM codes_new
+   WHERE code_name IS NULL
+      OR code_name NOT GLOB '[a-z][a-z]*'
+      OR length(code_name) NOT BETWEEN 1 AND 32
+UNION ALL
+  -- лимит: не более 10 кодексов на чат
+  SELECT COUNT(*) FROM (
+    SELECT chat_id, COUNT(*) n
+    FROM codes_new
+    WHERE chat_id IS NOT NULL
+    GROUP BY chat_id
+    HAVING n > 10
+  )
+UNION ALL
+  -- длины статей/описаний
+  SELECT COUNT(*) FROM codes_sentences_new
+   WHERE length(sentence_name) NOT BETWEEN 1 AND 64
+      OR length(sentence_description) NOT BETWEEN 1 AND 4096
+UNION ALL
+  -- лимит: не более 500 статей на кодекс
+  SELECT COUNT(*) FROM (
+    SELECT code_id, COUNT(*) n
+    FROM codes_sentences_new
+    GROUP BY code_id
+    HAVING n > 500
+  );
+
+-- если сумма нарушений > 0 — падаем
+INSERT INTO _assert
+SELECT IFNULL(SUM(v),0) FROM _violations;
+
+-- ---------- swap ----------
+ALTER TABLE codes            RENAME TO codes_old;
+ALTER TABLE codes_sentences  RENAME TO codes_sentences_old;
+
+ALTER TABLE codes_new            RENAME TO codes;
+ALTER TABLE codes_sentences_new  RENAME TO codes_sentences;
+
+DROP TABLE codes_old;
+DROP TABLE codes_sentences_old;
+
+-- ---------- indexes ----------
+CREATE UNIQUE INDEX IF NOT EXISTS unq_codes_null_chat
+  ON codes(code_name) WHERE chat_id IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_codes_chat_id       ON codes(chat_id);
+CREATE INDEX IF NOT EXISTS idx_sentences_code_id   ON codes_sentences(code_id);
+CREATE INDEX IF NOT EXISTS idx_sentences_code_name ON codes_sentences(code_id, sentence_name);
+CREATE UNIQUE INDEX IF NOT EXISTS unq_sentences_code_ord ON codes_sentences(code_id, ord);
+
+-- ---------- triggers ----------
+-- reserved 'ukrf'
+CREATE TRIGGER IF NOT EXISTS trg_codes_block_ukrf_ins
+BEFORE INSERT ON codes
+FOR EACH ROW
+WHEN NEW.code_name = 'ukrf' AND NEW.chat_id IS NOT NULL
+BEGIN
+  SELECT RAISE(ABORT, 'code_name ukrf is reserved for default (NULL chat)');
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_codes_block_ukrf_upd
+BEFORE UPDATE OF chat_id, code_name ON codes
+FOR EACH ROW
+WHEN (OLD.code_name = 'ukrf' AND OLD.chat_id IS NULL AND NEW.chat_id IS NOT NULL)
+   OR (OLD.code_name = 'ukrf' AND NEW.code_name <> 'ukrf')
+   OR (NEW.code_name = 'ukrf' AND NEW.chat_id IS NOT NULL)
+BEGIN
+  SELECT RAISE(ABORT, 'default ukrf is immutable and reserved');
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_codes_block_ukrf_del
+BEFORE DELETE ON codes
+FOR EACH ROW
+WHEN OLD.code_name = 'ukrf' AND OLD.chat_id IS NULL
+BEGIN
+  SELECT RAISE(ABORT, 'default ukrf cannot be deleted');
+END;
+
+-- per-chat limit 10
+CREATE TRIGGER IF NOT EXISTS trg_codes_limit_per_chat_ins
+BEFORE INSERT ON codes
+FOR EACH ROW
+WHEN NEW.chat_id IS NOT NULL
+ AND (SELECT COUNT(*) FROM codes c WHERE c.chat_id = NEW.chat_id) >= 10
+BEGIN
+  SELECT RAISE(ABORT, 'codes per chat limit reached');
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_codes_limit_per_chat_upd
+BEFORE UPDATE OF chat_id ON codes
+FOR EACH ROW
+WHEN NEW.chat_id IS NOT NULL
+ AND (SELECT COUNT(*) FROM codes c WHERE c.chat_id = NEW.chat_id) >= 10
+BEGIN
+  SELECT RAISE(ABORT, 'codes per chat limit reached');
+END;
+
+-- per-code sentences limit 500
+CREATE TRIGGER IF NOT EXISTS trg_sentences_limit_per_code_ins
+BEFORE INSERT ON codes_sentences
+FOR EACH ROW
+WHEN (SELECT COUNT(*) FROM codes_sentences s WHERE s.code_id = NEW.code_id) >= 500
+BEGIN
+  SELECT RAISE(ABORT, 'sentences per code limit reached');
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_sentences_limit_per_code_upd
+BEFORE UPDATE OF code_id ON codes_sentences
+FOR EACH ROW
+WHEN (SELECT COUNT(*) FROM codes_sentences s WHERE s.code_id = NEW.code_id) >= 500
+BEGIN
+  SELECT RAISE(ABORT, 'sentences per code limit reached');
+END;
+
+-- sentence ordinals: новая статья получает номер n+1,
+-- на место удалённой переезжает последняя, так что номера остаются 1..n
+CREATE TRIGGER IF NOT EXISTS trg_sentences_ord_ins
+AFTER INSERT ON codes_sentences
+FOR EACH ROW
+BEGIN
+  UPDATE codes_sentences
+     SET ord = (SELECT IFNULL(MAX(ord), 0) + 1 FROM codes_sentences WHERE code_id = NEW.code_id)
+   WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_sentences_ord_del
+AFTER DELETE ON codes_sentences
+FOR EACH ROW
+BEGIN
+  UPDATE codes_sentences
+     SET ord = OLD.ord
+   WHERE code_id = OLD.code_id
+     AND ord > OLD.ord
+     AND ord = (SELECT MAX(ord) FROM codes_sentences WHERE code_id = OLD.code_id);
+END;
+
+-- ---------- cache generation ----------
+-- любое изменение кодексов увеличивает счётчик; кэш OmonDB в каждом процессе сверяется с ним
+CREATE TABLE IF NOT EXISTS omon_generation (
+  id    INTEGER PRIMARY KEY CHECK (id = 0),
+  value INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO omon_generation(id, value) VALUES (0, 0);
+
+CREATE TRIGGER IF NOT EXISTS trg_codes_generation_ins
+AFTER INSERT ON codes
+BEGIN
+  UPDATE omon_generation SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_codes_generation_upd
+AFTER UPDATE ON codes
+BEGIN
+  UPDATE omon_generation SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_codes_generation_del
+AFTER DELETE ON codes
+BEGIN
+  UPDATE omon_generation SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_sentences_generation_ins
+AFTER INSERT ON codes_sentences
+BEGIN
+  UPDATE omon_generation SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_sentences_generation_upd
+AFTER UPDATE ON codes_sentences
+BEGIN
+  UPDATE omon_generation SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_sentences_generation_del
+AFTER DELETE ON codes_sentences
+BEGIN
+  UPDATE omon_generation SET value = value + 1;
+END;
@@ -0,0 +1,112 @@
+-- ===================== 002: maintained counters (SQLite) =====================
+-- Число статей кодекса и кодексов чата хранится готовым и поддерживается триггерами:
+-- лимиты и get_codes читают одну строку вместо COUNT(*) / GROUP BY по всем статьям.
+
+-- ---------- counters ----------
+ALTER TABLE codes ADD COLUMN n_sentences INTEGER NOT NULL DEFAULT 0;
+
+UPDATE codes
+   SET n_sentences = (SELECT COUNT(*) FROM codes_sentences s WHERE s.code_id = codes.id);
+
+CREATE TABLE IF NOT EXISTS chat_code_counts (
+  chat_id INTEGER PRIMARY KEY NOT NULL,
+  n_codes INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT INTO chat_code_counts(chat_id, n_codes)
+SELECT chat_id, COUNT(*) FROM codes WHERE chat_id IS NOT NULL GROUP BY chat_id;
+
+-- ---------- limits against counters ----------
+DROP TRIGGER IF EXISTS trg_codes_limit_per_chat_ins;
+DROP TRIGGER IF EXISTS trg_codes_limit_per_chat_upd;
+DROP TRIGGER IF EXISTS trg_sentences_limit_per_code_ins;
+DROP TRIGGER IF EXISTS trg_sentences_limit_per_code_upd;
+
+-- per-chat limit 10
+CREATE TRIGGER trg_codes_limit_per_chat_ins
+BEFORE INSERT ON codes
+FOR EACH ROW
+WHEN NEW.chat_id IS NOT NULL
+ AND IFNULL((SELECT n_codes FROM chat_code_counts WHERE chat_id = NEW.chat_id), 0) >= 10
+BEGIN
+  SELECT RAISE(ABORT, 'codes per chat limit reached');
+END;
+
+CREATE TRIGGER trg_codes_limit_per_chat_upd
+BEFORE UPDATE OF chat_id ON codes
+FOR EACH ROW
+WHEN NEW.chat_id IS NOT NULL
+ AND NEW.chat_id IS NOT OLD.chat_id
+ AND IFNULL((SELECT n_codes FROM chat_code_counts WHERE chat_id = NEW.chat_id), 0) >= 10
+BEGIN
+  SELECT RAISE(ABORT, 'codes per chat limit reached');
+END;
+
+-- per-code sentences limit 500
+CREATE TRIGGER trg_sentences_limit_per_code_ins
+BEFORE INSERT ON codes_sentences
+FOR EACH ROW
+WHEN (SELECT n_sentences FROM codes WHERE id = NEW.code_id) >= 500
+BEGIN
+  SELECT RAISE(ABORT, 'sentences per code limit reached');
+END;
+
+CREATE TRIGGER trg_sentences_limit_per_code_upd
+BEFORE UPDATE OF code_id ON codes_sentences
+FOR EACH ROW
+WHEN NEW.code_id <> OLD.code_id
+ AND (SELECT n_sentences FROM codes WHERE id = NEW.code_id) >= 500
+BEGIN
+  SELECT RAISE(ABORT, 'sentences per code limit reached');
+END;
+
+-- ---------- counter maintenance ----------
+CREATE TRIGGER trg_sentences_count_ins
+AFTER INSERT ON codes_sentences
+FOR EACH ROW
+BEGIN
+  UPDATE codes SET n_sentences = n_sentences + 1 WHERE id = NEW.code_id;
+END;
+
+CREATE TRIGGER trg_sentences_count_del
+AFTER DELETE ON codes_sentences
+FOR EACH ROW
+BEGIN
+  UPDATE codes SET n_sentences = n_sentences - 1 WHERE id = OLD.code_id;
+END;
+
+CREATE TRIGGER trg_sentences_count_upd
+AFTER UPDATE OF code_id ON codes_sentences
+FOR EACH ROW
+WHEN NEW.code_id <> OLD.code_id
+BEGIN
+  UPDATE codes SET n_sentences = n_sentences - 1 WHERE id = OLD.code_id;
+  UPDATE codes SET n_sentences = n_sentences + 1 WHERE id = NEW.code_id;
+END;
+
+CREATE TRIGGER trg_codes_count_ins
+AFTER INSERT ON codes
+FOR EACH ROW
+WHEN NEW.chat_id IS NOT NULL
+BEGIN
+  INSERT INTO chat_code_counts(chat_id, n_codes) VALUES (NEW.chat_id, 1)
+    ON CONFLICT(chat_id) DO UPDATE SET n_codes = n_codes + 1;
+END;
+
+CREATE TRIGGER trg_codes_count_del
+AFTER DELETE ON codes
+FOR EACH ROW
+WHEN OLD.chat_id IS NOT NULL
+BEGIN
+  UPDATE chat_code_counts SET n_codes = n_codes - 1 WHERE chat_id = OLD.chat_id;
+END;
+
+CREATE TRIGGER trg_codes_count_upd
+AFTER UPDATE OF chat_id ON codes
+FOR EACH ROW
+WHEN NEW.chat_id IS NOT OLD.chat_id
+BEGIN
+  UPDATE chat_code_counts SET n_codes = n_codes - 1 WHERE chat_id = OLD.chat_id;
+  INSERT INTO chat_code_counts(chat_id, n_codes) SELECT NEW.chat_id, 1 WHERE NEW.chat_id IS NOT NULL
+    ON CONFLICT(chat_id) DO UPDATE SET n_codes = n_codes + 1;
+END;